@@ -0,0 +1,195 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+# commandline parameters e.g "bench=parse_ascii_grid repeat=5"
+
+import copy
+import json
+import numpy as np
+from scipy.interpolate import NearestNDInterpolator
+import sys
+import time
+import tracemalloc
+
+import monica_io
+import monica_run_lib as Mrunlib
+
+PATH_TO_DATA_DIR = "./data/"
+DATA_GRID_SOIL = "germany/buek200_1000_25832_etrs89-utm32n.asc"
+
+
+def time_it(f, repeat):
+    "return the best wall clock time of repeat calls to f"
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        took = time.perf_counter() - start
+        best = took if best is None else min(best, took)
+    return best
+
+
+def bench_parse_ascii_grid(config):
+    """compare np.loadtxt (parses a grid in Mrunlib.load_ascii_grid if there is no .npy sidecar yet)
+    with a bulk np.fromstring parse of the data part of the soil grid"""
+    path = PATH_TO_DATA_DIR + DATA_GRID_SOIL
+    repeat = int(config["repeat"])
+
+    def parse_with_fromstring():
+        with open(path, "rb") as _:
+            for i in range(0, 6):
+                _.readline()
+            return np.fromstring(_.read(), dtype=int, sep=" ")
+
+    loadtxt_grid = np.loadtxt(path, dtype=int, skiprows=6)
+    print("grids equal:", np.array_equal(loadtxt_grid.ravel(), parse_with_fromstring()))
+
+    t_loadtxt = time_it(lambda: np.loadtxt(path, dtype=int, skiprows=6), repeat)
+    t_fromstring = time_it(parse_with_fromstring, repeat)
+    print("np.loadtxt:    ", round(t_loadtxt * 1000, 2), "ms")
+    print("np.fromstring: ", round(t_fromstring * 1000, 2), "ms", "speedup:", round(t_loadtxt / t_fromstring, 1))
+
+
+def create_nearest_nd_interpolator(grid, meta_data):
+    "the former KD-tree based Mrunlib.create_ascii_grid_interpolator, used as reference"
+    rows, cols = grid.shape
+    cellsize = int(meta_data["cellsize"])
+    xll_center = int(meta_data["xllcorner"]) + cellsize // 2
+    yul_center = int(meta_data["yllcorner"]) + cellsize // 2 + (rows - 1)*cellsize
+
+    points = []
+    values = []
+    for row in range(rows):
+        for col in range(cols):
+            value = grid[row, col]
+            if value == meta_data["nodata_value"]:
+                continue
+            points.append([xll_center + col * cellsize, yul_center - row * cellsize])
+            values.append(value)
+
+    return NearestNDInterpolator(np.array(points), np.array(values))
+
+
+def bench_grid_interpolator(config):
+    "compare the NearestNDInterpolator with the regular grid lookup on the soil grid"
+    path = PATH_TO_DATA_DIR + DATA_GRID_SOIL
+    repeat = int(config["repeat"])
+    meta, _ = Mrunlib.read_header(path)
+    grid = Mrunlib.load_ascii_grid(path, dtype=int)
+    rows, cols = grid.shape
+    cellsize = int(meta["cellsize"])
+
+    t_old_build = time_it(lambda: create_nearest_nd_interpolator(grid, meta), 1)
+    t_new_build = time_it(lambda: Mrunlib.create_ascii_grid_interpolator(grid, meta), repeat)
+    print("build NearestNDInterpolator:  ", round(t_old_build * 1000, 2), "ms")
+    print("build grid lookup:            ", round(t_new_build * 1000, 2), "ms", "speedup:", round(t_old_build / t_new_build, 1))
+
+    old = create_nearest_nd_interpolator(grid, meta)
+    new = Mrunlib.create_ascii_grid_interpolator(grid, meta)
+
+    # all cell centers, as queried by the producer, plus random points in and around the grid
+    rs, cs = np.mgrid[0:rows, 0:cols]
+    xs = (int(meta["xllcorner"]) + cellsize // 2 + cs * cellsize).ravel().astype(float)
+    ys = (int(meta["yllcorner"]) + cellsize // 2 + (rows - 1 - rs) * cellsize).ravel().astype(float)
+    rng = np.random.default_rng(0)
+    rxs = rng.uniform(xs.min() - 10 * cellsize, xs.max() + 10 * cellsize, 100000)
+    rys = rng.uniform(ys.min() - 10 * cellsize, ys.max() + 10 * cellsize, 100000)
+    print("same values at cell centers:  ", np.array_equal(old(xs, ys), new(xs, ys)))
+    print("same values at random points: ", np.array_equal(old(rxs, rys), new(rxs, rys)))
+
+    n = 10000
+    sxs = xs.tolist()[:n]
+    sys_ = ys.tolist()[:n]
+    t_old = time_it(lambda: [old(x, y) for x, y in zip(sxs, sys_)], 1)
+    t_new = time_it(lambda: [new(x, y) for x, y in zip(sxs, sys_)], repeat)
+    print("scalar query NearestNDInterpolator:", round(t_old / n * 1e6, 2), "us")
+    print("scalar query grid lookup:          ", round(t_new / n * 1e6, 2), "us", "speedup:", round(t_old / t_new, 1))
+
+
+def peak_memory(f):
+    "return the peak memory allocated [bytes] during a call to f"
+    tracemalloc.start()
+    try:
+        f()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_resolve_references(config):
+    "compare monica_io.find_and_replace_references with monica_io.resolve_references on all crop rotation templates"
+    configs = {}
+    for name in ["crop", "site", "sim"]:
+        with open(name + ".json") as _:
+            configs[name] = json.load(_)
+    for name in ["crop", "site"]:
+        configs[name].setdefault("include-file-base-path", configs["sim"]["include-file-base-path"])
+    repeat = int(config["repeat"])
+
+    # one crop config per crop rotation template, as the producer creates them per setup
+    roots = []
+    for crop_id in configs["crop"]["cropRotationTemplates"].keys():
+        crop_json = copy.deepcopy(configs["crop"])
+        crop_json["cropRotation"][2] = crop_id
+        roots.append(crop_json)
+    roots += [configs["site"], configs["sim"]]
+
+    # the include file cache is used by both, fill it first
+    for root in roots:
+        monica_io.find_and_replace_references(root, root)
+
+    same = all(json.dumps(monica_io.find_and_replace_references(root, root))
+               == json.dumps(monica_io.resolve_references(root, root)) for root in roots)
+    print("same results:", same)
+
+    resolve_all = lambda resolve: [resolve(root, root) for root in roots]
+    t_old = time_it(lambda: resolve_all(monica_io.find_and_replace_references), repeat)
+    t_new = time_it(lambda: resolve_all(monica_io.resolve_references), repeat)
+    m_old = peak_memory(lambda: resolve_all(monica_io.find_and_replace_references))
+    m_new = peak_memory(lambda: resolve_all(monica_io.resolve_references))
+    print("find_and_replace_references:", round(t_old * 1000, 2), "ms", round(m_old / 1024), "KiB peak")
+    print("resolve_references:         ", round(t_new * 1000, 2), "ms", round(m_new / 1024), "KiB peak",
+          "speedup:", round(t_old / t_new, 1))
+
+
+BENCHMARKS = {
+    "parse_ascii_grid": bench_parse_ascii_grid,
+    "grid_interpolator": bench_grid_interpolator,
+    "resolve_references": bench_resolve_references,
+}
+
+
+def run_benchmarks():
+    config = {
+        "bench": "all",
+        "repeat": "5"
+    }
+
+    if len(sys.argv) > 1 and __name__ == "__main__":
+        for arg in sys.argv[1:]:
+            k, v = arg.split("=")
+            if k in config:
+                config[k] = v
+
+    for name, bench in BENCHMARKS.items():
+        if config["bench"] in ["all", name]:
+            print("benchmark:", name)
+            bench(config)
+
+
+if __name__ == "__main__":
+    run_benchmarks()
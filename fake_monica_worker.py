@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+# stands in for monica-zmq-proxy and the MONICA workers to test the env pipeline locally:
+# receives the envs (also compressed ones) on the proxy input port, checks that they are valid json envs
+# and optionally writes them (one per line) to a file, e.g. to compare
+# run_producer.py env-protocol=full with env-protocol=delta + run_env_expander.py
+
+import json
+import sys
+import zmq
+
+import monica_run_lib as Mrunlib
+
+
+# commandline parameters e.g "port=6666 out=envs.txt timeout=10000"
+def run_fake_monica_worker():
+    config = {
+        "port": "6666",
+        "out": "", # path of a file to write the received envs to
+        "timeout": "10000" # ms without envs until exiting
+    }
+
+    if len(sys.argv) > 1 and __name__ == "__main__":
+        for arg in sys.argv[1:]:
+            k, v = arg.split("=")
+            if k in config:
+                config[k] = v
+
+    context = zmq.Context()
+    socket = context.socket(zmq.PULL)
+    socket.bind("tcp://*:" + config["port"])
+    socket.RCVTIMEO = int(config["timeout"])
+
+    out_file = open(config["out"], "wb") if config["out"] else None
+    received_env_count = 0
+    received_bytes = 0
+    nodata_count = 0
+    while True:
+        try:
+            env = Mrunlib.decode_frames(socket.recv_multipart())[0]
+        except zmq.error.Again:
+            break
+
+        if out_file:
+            out_file.write(env + b"\n")
+        if json.loads(env)["customId"].get("nodata", False):
+            nodata_count += 1
+        received_env_count += 1
+        received_bytes += len(env)
+
+    if out_file:
+        out_file.close()
+    print("received", received_env_count, "envs (", nodata_count, "nodata ),", received_bytes, "bytes")
+
+
+if __name__ == "__main__":
+    run_fake_monica_worker()
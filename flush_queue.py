@@ -39,7 +39,8 @@ socket.connect("tcp://" + config["server"] + ":" + config["port"])
 
 i = 0
 while True:
-    socket.recv_json(encoding="latin-1")
+    # compressed (codec header + frames) or plain json messages
+    socket.recv_multipart()
     if i%10 == 0:
         print(i, end=" ", flush=True)
     i = i + 1
@@ -18,7 +18,21 @@ from pathlib import Path
 import sys
 import soil_io
 
-CACHE_REFS = False
+# cache the resolved "ref"s of a root while resolving it (find_and_replace_references(root, root))
+CACHE_REFS = True
+# keep the parsed files of "include-from-file" for the process lifetime, re-read if their mtime changes
+CACHE_INCLUDES = True
+
+# absolute path -> (mtime, parsed json) of the included files
+include_file_cache = {}
+# (root, {(key1, key2): result}) of the root whose references are currently resolved
+ref_cache = [None, {}]
+# absolute paths of all files included so far (e.g. to check if a result built from them is still valid)
+included_files = set()
+# name -> value (None if not set) of all environment variables used in include paths so far
+expanded_env_vars = {}
+# hits and misses of the include file and ref caches
+cache_stats = {"include-hits": 0, "include-misses": 0, "ref-hits": 0, "ref-misses": 0}
 
 OP_AVG = 0
 OP_MEDIAN = 1
@@ -212,6 +226,7 @@ def replace_env_vars(path):
             name_start = start_pos + 2
             env_var_name = path[name_start : end_pos]
             env_var_content = os.environ.get(env_var_name, None)
+            expanded_env_vars[env_var_name] = env_var_content
             if env_var_content:
                 path = path.replace(path[start_pos : end_pos + 1], env_var_content)
                 start_pos = path.find(start_token)
@@ -238,6 +253,39 @@ def read_and_parse_json_file(path):
                 "success": False}
 
 
+def read_and_parse_json_file_cached(path):
+    """read_and_parse_json_file memoized on the absolute path and mtime of the file (if CACHE_INCLUDES)
+    the result is shared between all calls and must not be modified"""
+    if not CACHE_INCLUDES:
+        return read_and_parse_json_file(path)
+
+    abs_path = os.path.abspath(path)
+    try:
+        mtime = os.stat(abs_path).st_mtime_ns
+    except OSError:
+        return read_and_parse_json_file(path)
+
+    cached = include_file_cache.get(abs_path)
+    if cached and cached[0] == mtime:
+        cache_stats["include-hits"] += 1
+        return {"result": cached[1], "errors": [], "success": True}
+
+    cache_stats["include-misses"] += 1
+    res = read_and_parse_json_file(path)
+    if res["success"]:
+        include_file_cache[abs_path] = (mtime, res["result"])
+    return res
+
+
+def clear_caches():
+    "clear the include file and ref caches and their stats"
+    include_file_cache.clear()
+    ref_cache[0] = None
+    ref_cache[1].clear()
+    for k in cache_stats:
+        cache_stats[k] = 0
+
+
 def parse_json_string(jsonString):
     return {"result": json.loads(jsonString), "errors": [], "success": True}
 
@@ -249,6 +297,11 @@ def is_string_type(j):
 def find_and_replace_references(root, j):
     sp = supported_patterns()
 
+    # resolving a root (again) starts with an empty ref cache, the root might have been changed
+    if j is root:
+        ref_cache[0] = root
+        ref_cache[1].clear()
+
     success = True
     errors = []
 
@@ -318,12 +371,115 @@ def find_and_replace_references(root, j):
     return {"result": j, "errors": errors, "success": len(errors) == 0}
 
 
+def copy_json(j):
+    "copy the dicts and lists of a json structure"
+    if isinstance(j, dict):
+        return {k: copy_json(v) for k, v in j.items()}
+    elif isinstance(j, list):
+        return [copy_json(v) for v in j]
+    return j
+
+
+# frame kinds of resolve_references
+_LIST = 0
+_DICT = 1
+_CALL = 2
+_RESULT = 3
+
+
+def resolve_references(root, j):
+    """resolve the references (supported_patterns) in j, like find_and_replace_references,
+    but walking the tree iteratively and keeping all subtrees of j without references as they are (not copied)
+    the result shares these subtrees with j, included files and repeated refs are copied
+    returns {"result": resolved j, "errors": all errors, "success": no errors}"""
+
+    sp = supported_patterns()
+    errors = []
+
+    if j is root:
+        ref_cache[0] = root
+        ref_cache[1].clear()
+    use_ref_cache = CACHE_REFS and ref_cache[0] is root
+
+    # frame: [kind, node, children, index of the next child, resolved children (None while none changed), ref cache key]
+    stack = []
+
+    def enter(node):
+        "push a frame for a non empty list/dict, True if one was pushed"
+        if isinstance(node, list):
+            if node:
+                stack.append([_CALL if is_string_type(node[0]) and node[0] in sp else _LIST, node, node, 0, None, None])
+                return True
+        elif isinstance(node, dict):
+            if node:
+                stack.append([_DICT, node, list(node.values()), 0, None, None])
+                return True
+        return False
+
+    value = j
+    has_value = not enter(j)
+    while stack:
+        frame = stack[-1]
+        kind, node, children, i, resolved, _ = frame
+
+        if has_value:
+            # value is the resolved child i
+            if resolved is None and value is not children[i]:
+                resolved = frame[4] = children[:i]
+            if resolved is not None:
+                resolved.append(value)
+            i = frame[3] = i + 1
+            has_value = False
+
+        if i < len(children):
+            value = children[i]
+            has_value = not enter(value)
+            continue
+
+        stack.pop()
+        if kind == _LIST:
+            value = node if resolved is None else resolved
+        elif kind == _DICT:
+            value = node if resolved is None else dict(zip(node.keys(), resolved))
+        elif kind == _RESULT:
+            value = resolved[0] if resolved is not None else children[0]
+            if frame[5] is not None:
+                ref_cache[1][frame[5]] = value
+        else:
+            args = node if resolved is None else resolved
+            name = args[0]
+            if name == "ref" and len(args) == 3 and is_string_type(args[1]) and is_string_type(args[2]):
+                key = (args[1], args[2])
+                if use_ref_cache and key in ref_cache[1]:
+                    cache_stats["ref-hits"] += 1
+                    value = copy_json(ref_cache[1][key])
+                else:
+                    if use_ref_cache:
+                        cache_stats["ref-misses"] += 1
+                    target = root[key[0]][key[1]]
+                    stack.append([_RESULT, target, [target], 0, None, key if use_ref_cache else None])
+                    value = None
+                    continue
+            else:
+                res = sp[name](root, args)
+                if not res["success"]:
+                    errors.extend(res["errors"])
+                    value = {}
+                else:
+                    # included files are shared by the include file cache
+                    target = copy_json(res["result"]) if name == "include-from-file" else res["result"]
+                    stack.append([_RESULT, target, [target], 0, None, None])
+                    value = None
+                    continue
+
+        has_value = True
+
+    return {"result": value, "errors": errors, "success": len(errors) == 0}
+
+
 def supported_patterns():
 
     def ref(root, j):
-        if CACHE_REFS and "cache" not in ref.__dict__:
-            ref.cache = {}
-
         if len(j) == 3 \
          and is_string_type(j[1]) \
          and is_string_type(j[2]):
@@ -331,13 +487,17 @@ def supported_patterns():
             key1 = j[1]
             key2 = j[2]
 
-            if CACHE_REFS and (key1, key2) in ref.cache:
-                return ref.cache[(key1, key2)]
+            # the cache only holds refs of the root being resolved
+            use_cache = CACHE_REFS and ref_cache[0] is root
+            if use_cache and (key1, key2) in ref_cache[1]:
+                cache_stats["ref-hits"] += 1
+                return ref_cache[1][(key1, key2)]
 
             res = find_and_replace_references(root, root[key1][key2])
-            
-            if CACHE_REFS:
-                ref.cache[(key1, key2)] = res
+
+            if use_cache:
+                cache_stats["ref-misses"] += 1
+                ref_cache[1][(key1, key2)] = res
             return res
 
         return {"result": j,
@@ -499,8 +659,9 @@ def supported_patterns():
                 path_to_file = base_path + "/" + path_to_file
             path_to_file = replace_env_vars(path_to_file)
             path_to_file = fix_system_separator(path_to_file)
-            jo_ = read_and_parse_json_file(path_to_file)
+            jo_ = read_and_parse_json_file_cached(path_to_file)
             if jo_["success"] and not isinstance(jo_["result"], type(None)):
+                included_files.add(os.path.abspath(path_to_file))
                 return {"result": jo_["result"], "errors": [], "success": True}
 
             return {"result": j__,
@@ -613,7 +774,7 @@ def create_env_json_from_json_config(crop_site_sim):
             continue
 
         add_base_path(j, path_to_parameters)
-        res = find_and_replace_references(j, j)
+        res = resolve_references(j, j)
         if res["success"]:
             crop_site_sim2[k] = res["result"]
         else:
@@ -626,7 +787,9 @@ def create_env_json_from_json_config(crop_site_sim):
 
     cropj = crop_site_sim2["crop"]
     sitej = crop_site_sim2["site"]
-    simj = crop_site_sim2["sim"]
+    # the resolved configs share unchanged parts with crop_site_sim, copy what is changed below
+    simj = dict(crop_site_sim2["sim"])
+    simj["climate.csv-options"] = dict(simj["climate.csv-options"])
 
     env = {}
     env["type"] = "Env"
@@ -16,11 +16,20 @@
 # Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
 
 import csv
+import hashlib
 import json
+import lzma
+import math
 import numpy as np
-from scipy.interpolate import NearestNDInterpolator
+import os
+import re
+import struct
+from scipy.spatial import cKDTree
 from pyproj import Transformer
 from datetime import date, timedelta
+import zlib
+
+import monica_io
 
 
 def read_csv(path_to_setups_csv, key="run-id"):
@@ -83,10 +92,72 @@ def read_header(path_to_ascii_grid_file):
     return metadata, header_str
 
 
+def load_ascii_grid(path_to_ascii_grid_file, dtype=int, use_cache=True, mmap_mode="r"):
+    """load the data part of an esri ascii grid file
+    the parsed grid is stored as .npy sidecar next to the .asc file and reused as long as
+    mtime and size of the .asc file don't change, the sidecar is memory mapped, so that
+    all processes on a node share the same pages (use mmap_mode="c" to get a writable copy-on-write grid)"""
+
+    dtype = np.dtype(dtype)
+    if not use_cache:
+        return np.loadtxt(path_to_ascii_grid_file, dtype=dtype, skiprows=6)
+
+    path_to_npy = path_to_ascii_grid_file + ".npy"
+    path_to_key = path_to_npy + ".json"
+    stat = os.stat(path_to_ascii_grid_file)
+    key = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "dtype": dtype.str}
+
+    try:
+        with open(path_to_key) as _:
+            if json.load(_) == key:
+                return np.load(path_to_npy, mmap_mode=mmap_mode)
+    except (OSError, ValueError):
+        pass
+
+    grid = np.loadtxt(path_to_ascii_grid_file, dtype=dtype, skiprows=6)
+
+    # write to temporary files first, so concurrently starting processes never see a half written sidecar
+    try:
+        tmp_suffix = ".tmp{}".format(os.getpid())
+        with open(path_to_npy + tmp_suffix, "wb") as _:
+            np.save(_, grid)
+        with open(path_to_key + tmp_suffix, "w") as _:
+            json.dump(key, _)
+        os.replace(path_to_npy + tmp_suffix, path_to_npy)
+        os.replace(path_to_key + tmp_suffix, path_to_key)
+    except OSError as e:
+        print("Couldn't write grid cache for:", path_to_ascii_grid_file, "Exception:", e)
+        return grid
+
+    return np.load(path_to_npy, mmap_mode=mmap_mode)
+
+def write_ascii_grid(path_to_ascii_grid_file, grid, meta_data):
+    "write a 2D array as esri ascii grid file, meta_data as returned by read_header"
+    def fmt_num(v):
+        return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+    rows, cols = grid.shape
+    header = "ncols {}\nnrows {}\nxllcorner {}\nyllcorner {}\ncellsize {}\nNODATA_value {}\n".format(
+        cols, rows, fmt_num(meta_data["xllcorner"]), fmt_num(meta_data["yllcorner"]),
+        fmt_num(meta_data["cellsize"]), fmt_num(meta_data["nodata_value"]))
+
+    tmp_path = path_to_ascii_grid_file + ".tmp{}".format(os.getpid())
+    with open(tmp_path, "w") as _:
+        _.write(header)
+        np.savetxt(_, grid, fmt="%d" if np.issubdtype(grid.dtype, np.integer) else "%.10g")
+    os.replace(tmp_path, path_to_ascii_grid_file)
+
+
 def create_ascii_grid_interpolator(grid, meta_data, ignore_nodata=True):
-    "read an ascii grid into a map, without the no-data values"
-    "grid - 2D array of values"
+    """create a nearest neighbour lookup f(x, y) into an ascii grid, without the no-data values
+    grid - 2D array of values
 
+    the cell of (x, y) is computed directly from the grid geometry, only if that cell is a
+    no-data cell (or outside the grid) the nearest valid cell is searched in a kd-tree of the valid cells,
+    for no-data cell centers the result is kept in a nearest-valid map, so each such cell is searched once
+    (same answers as a NearestNDInterpolator on all valid cell centers)"""
+
+    grid = np.asarray(grid)
     rows, cols = grid.shape
 
     cellsize = int(meta_data["cellsize"])
@@ -98,28 +169,198 @@ def create_ascii_grid_interpolator(grid, meta_data, ignore_nodata=True):
     yll_center = yll + cellsize // 2
     yul_center = yll_center + (rows - 1)*cellsize
 
-    points = []
-    values = []
-
-    for row in range(rows):
-        for col in range(cols):
-            value = grid[row, col]
-            if ignore_nodata and value == nodata_value:
-                continue
-            r = xll_center + col * cellsize
-            h = yul_center - row * cellsize
-            points.append([r, h])
-            values.append(value)
-
-    return NearestNDInterpolator(np.array(points), np.array(values))
+    if ignore_nodata:
+        is_valid = grid != nodata_value
+    else:
+        is_valid = np.ones(grid.shape, dtype=bool)
+
+    # value of the nearest valid cell at every cell center, known for valid cells from the start
+    nearest_values = np.array(grid)
+    is_known = is_valid.copy()
+    tree_and_values = []
+
+    def get_tree_and_values():
+        if not tree_and_values:
+            # valid cells in row major order, the same point order the interpolator was built with before
+            valid_rows, valid_cols = np.nonzero(is_valid)
+            points = np.column_stack((xll_center + valid_cols * cellsize, yul_center - valid_rows * cellsize))
+            tree_and_values.extend((cKDTree(points.astype(float)), grid[valid_rows, valid_cols]))
+        return tree_and_values
+
+    def query_tree(x, y):
+        tree, values = get_tree_and_values()
+        _, idxs = tree.query(np.column_stack((np.ravel(x), np.ravel(y))))
+        return values[idxs]
+
+    def interpolate_scalar(x, y):
+        col = math.floor((x - xll_center) / cellsize + 0.5)
+        row = math.floor((yul_center - y) / cellsize + 0.5)
+        if not (0 <= row < rows and 0 <= col < cols):
+            return query_tree(x, y)[0]
+        if is_valid[row, col]:
+            return nearest_values[row, col]
+        if x == xll_center + col * cellsize and y == yul_center - row * cellsize:
+            if not is_known[row, col]:
+                nearest_values[row, col] = query_tree(x, y)[0]
+                is_known[row, col] = True
+            return nearest_values[row, col]
+        return query_tree(x, y)[0]
+
+    def interpolate(x, y):
+        if isinstance(x, (int, float)) and isinstance(y, (int, float)):
+            return interpolate_scalar(x, y)
+
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        col = np.floor((x - xll_center) / cellsize + 0.5).astype(np.int64)
+        row = np.floor((yul_center - y) / cellsize + 0.5).astype(np.int64)
+        is_inside = (0 <= row) & (row < rows) & (0 <= col) & (col < cols)
+        row = np.where(is_inside, row, 0)
+        col = np.where(is_inside, col, 0)
+
+        # fill the nearest-valid map for all no-data cell centers hit the first time
+        is_center = is_inside & (x == xll_center + col * cellsize) & (y == yul_center - row * cellsize)
+        fill = is_center & ~is_known[row, col]
+        if np.any(fill):
+            nearest_values[row[fill], col[fill]] = query_tree(x[fill], y[fill])
+            is_known[row[fill], col[fill]] = True
+
+        use_map = is_inside & (is_valid[row, col] | is_center)
+        if np.all(use_map):
+            return nearest_values[row, col]
+
+        res = np.array(nearest_values[row, col])
+        res[~use_map] = query_tree(x[~use_map], y[~use_map])
+        return res[()]
+
+    return interpolate
+
+
+def create_nearest_interpolator(points, values):
+    """create a nearest neighbour lookup f(x, y) for scattered points, e.g. climate stations
+    x and y can be scalars or arrays of any shape, the values keep their dtype and
+    for multi component values (e.g. (row, col)) the components are in the last axis"""
+
+    tree = cKDTree(np.asarray(points, dtype=float))
+    values = np.asarray(values)
+
+    def interpolate(x, y):
+        if isinstance(x, (int, float)) and isinstance(y, (int, float)):
+            _, idx = tree.query((x, y))
+            return values[idx]
+
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        _, idxs = tree.query(np.column_stack((x.ravel(), y.ravel())))
+        return values[idxs].reshape(x.shape + values.shape[1:])
+
+    return interpolate
+
+
+def resample_ascii_grid(grid, meta_data, crs, target_meta_data, target_crs, method="nearest"):
+    """resample a grid (in crs) onto the geometry of a target grid (in target_crs)
+    method - "nearest": value at the target cell center, as a create_ascii_grid_interpolator lookup would return it
+             "majority": most frequent value of the valid source cells with their center in the target cell,
+                         target cells without such source cells get the nearest value
+    returns the resampled grid and its metadata (target geometry, no-data value of the source grid)"""
+
+    if method not in ["nearest", "majority"]:
+        raise ValueError("Unknown resampling method: {}".format(method))
+
+    grid = np.asarray(grid)
+    rows = int(target_meta_data["nrows"])
+    cols = int(target_meta_data["ncols"])
+    cellsize = int(target_meta_data["cellsize"])
+    xll = int(target_meta_data["xllcorner"])
+    yll = int(target_meta_data["yllcorner"])
+
+    # target cell centers in the source crs, the same centers the producer uses for the cells
+    trs, tcs = np.mgrid[0:rows, 0:cols]
+    txs = xll + (cellsize / 2) + tcs * cellsize
+    tys = yll + (cellsize / 2) + (rows - trs - 1) * cellsize
+    xs, ys = Transformer.from_crs(target_crs, crs, always_xy=True).transform(txs, tys)
+    resampled = np.array(create_ascii_grid_interpolator(grid, meta_data)(xs, ys), dtype=grid.dtype)
+
+    if method == "majority":
+        src_rows, src_cols = np.nonzero(grid != meta_data["nodata_value"])
+        src_cellsize = int(meta_data["cellsize"])
+        src_xs = int(meta_data["xllcorner"]) + src_cellsize // 2 + src_cols * src_cellsize
+        src_ys = int(meta_data["yllcorner"]) + src_cellsize // 2 + (grid.shape[0] - 1 - src_rows) * src_cellsize
+        src_xs, src_ys = Transformer.from_crs(crs, target_crs, always_xy=True).transform(src_xs.astype(float), src_ys.astype(float))
+        t_cols = np.floor((src_xs - xll) / cellsize).astype(np.int64)
+        t_rows = rows - 1 - np.floor((src_ys - yll) / cellsize).astype(np.int64)
+        is_inside = (0 <= t_rows) & (t_rows < rows) & (0 <= t_cols) & (t_cols < cols)
+
+        # count (target cell, value) pairs, per target cell the most frequent (then smallest) value wins
+        cells = t_rows[is_inside] * cols + t_cols[is_inside]
+        values, value_idxs = np.unique(grid[src_rows[is_inside], src_cols[is_inside]], return_inverse=True)
+        pairs, counts = np.unique(cells * len(values) + value_idxs, return_counts=True)
+        pairs = pairs[np.lexsort((-counts, pairs // len(values)))]
+        pair_cells = pairs // len(values)
+        is_first = np.ones(len(pairs), dtype=bool)
+        is_first[1:] = pair_cells[1:] != pair_cells[:-1]
+        resampled.ravel()[pair_cells[is_first]] = values[pairs[is_first] % len(values)]
+
+    target_meta = {
+        "ncols": float(cols),
+        "nrows": float(rows),
+        "xllcorner": float(target_meta_data["xllcorner"]),
+        "yllcorner": float(target_meta_data["yllcorner"]),
+        "cellsize": float(target_meta_data["cellsize"]),
+        "nodata_value": float(meta_data["nodata_value"])
+    }
+    return resampled, target_meta
+
+
+def load_or_create_aligned_ascii_grid(path_to_ascii_grid_file, crs, path_to_target_grid_file, target_crs,
+                                      method="nearest", dtype=int, path_to_aligned_grid_file=None):
+    """load a grid resampled onto the geometry of the target grid (e.g. the soil grid), so it can be indexed
+    with the row/col of the target grid, the aligned grid is written as ascii grid next to the source grid
+    (or to path_to_aligned_grid_file) and recreated if it is older than one of the input grids
+    returns the aligned grid and its metadata"""
+
+    if path_to_aligned_grid_file is None:
+        path_to_aligned_grid_file = "{}_aligned_{}_{}.asc".format(
+            os.path.splitext(path_to_ascii_grid_file)[0], method, target_crs.to_epsg())
+
+    try:
+        aligned_mtime = os.path.getmtime(path_to_aligned_grid_file)
+        if aligned_mtime >= max(os.path.getmtime(path_to_ascii_grid_file), os.path.getmtime(path_to_target_grid_file)):
+            meta_data, _ = read_header(path_to_aligned_grid_file)
+            return load_ascii_grid(path_to_aligned_grid_file, dtype=dtype), meta_data
+    except OSError:
+        pass
+
+    meta_data, _ = read_header(path_to_ascii_grid_file)
+    grid = load_ascii_grid(path_to_ascii_grid_file, dtype=dtype)
+    target_meta_data, _ = read_header(path_to_target_grid_file)
+    aligned_grid, aligned_meta = resample_ascii_grid(grid, meta_data, crs, target_meta_data, target_crs, method=method)
+    try:
+        write_ascii_grid(path_to_aligned_grid_file, aligned_grid, aligned_meta)
+        print("wrote aligned grid:", path_to_aligned_grid_file)
+    except OSError as e:
+        print("Couldn't write aligned grid:", path_to_aligned_grid_file, "Exception:", e)
+    return aligned_grid, aligned_meta
 
 
 def get_value(list_or_value):
    return list_or_value[0] if isinstance(list_or_value, list) else list_or_value
 
 
-def create_seed_harvest_geoGrid_interpolator_and_read_data(path_to_csv_file, worldGeodeticSys84, geoTargetGrid, ilr_seed_harvest_data):
-    """read seed/harvest dates and apoint climate stations"""
+# csv column of the doy per ILR date, the year part of the sowing dates is 0, of the harvest dates 0 or 1 (winter crops)
+ILR_DOY_COLUMNS = {
+    "sowing": 4,
+    "harvest": 6,
+    "earliest-sowing": 8,
+    "latest-sowing": 9,
+    "earliest-harvest": 10,
+    "latest-harvest": 11
+}
+
+def read_seed_harvest_station_store(path_to_csv_file, worldGeodeticSys84, geoTargetGrid):
+    """read seed/harvest dates of the ILR climate stations into an array backed store
+    per station (in the order of the csv) the station id, lat/lon, x/y in geoTargetGrid, the doys (as array)
+    and the dates as "YYYY-MM-DD" strings (as list) are kept, "index" maps the station id to the position
+    "interpolate" is a nearest neighbour lookup of the station id"""
 
     wintercrop = {
         "WW": True,
@@ -139,102 +380,541 @@ def create_seed_harvest_geoGrid_interpolator_and_read_data(path_to_csv_file, wor
 
     with open(path_to_csv_file) as _:
         reader = csv.reader(_)
-
-        #print "reading:", path_to_csv_file
-
         # skip header line
         next(reader)
+        rows = list(reader)
+
+    css = np.array([int(row[0]) for row in rows], dtype=np.int64)
+    lats = np.array([float(row[1]) for row in rows])
+    lons = np.array([float(row[2]) for row in rows])
+
+    # the data of a station is the one of its last row
+    index = {}
+    for i, cs in enumerate(css.tolist()):
+        index.pop(cs, None)
+        index[cs] = i
+    last_rows = np.array(list(index.values()), dtype=np.int64)
+
+    crop_id = rows[-1][3] if rows else None
+    is_wintercrop = wintercrop[crop_id] if rows else None
+    digit = 1 if is_wintercrop else 0
+    if crop_id == 'CLALF': digit = 2
+
+    store = {
+        "crop-id": crop_id,
+        "is-winter-crop": is_wintercrop,
+        "station": css[last_rows],
+        "index": {cs: i for i, cs in enumerate(index.keys())},
+        "lat": lats[last_rows],
+        "lon": lons[last_rows]
+    }
 
-        points = []  # climate station position (lat, long transformed to a geoTargetGrid, e.g gk5)
-        values = []  # climate station ids
+    transformer = Transformer.from_crs(worldGeodeticSys84, geoTargetGrid, always_xy=True)
+    store["x"], store["y"] = transformer.transform(store["lon"], store["lat"])
 
-        transformer = Transformer.from_crs(worldGeodeticSys84, geoTargetGrid, always_xy=True) 
+    base_date = date(2001, 1, 1)
+    for name, column in ILR_DOY_COLUMNS.items():
+        year = digit if name.endswith("harvest") else 0
+        doys = []
+        dates = []
+        for i in last_rows.tolist():
+            d = base_date + timedelta(days = int(float(rows[i][column])) - 1)
+            doys.append(d.timetuple().tm_yday)
+            dates.append("{:04d}-{:02d}-{:02d}".format(year, d.month, d.day))
+        store[name + "-doy"] = np.array(doys, dtype=np.int64)
+        store[name + "-date"] = dates
+
+    # a station is added to the lookup when the next station starts (so not the last station of the csv)
+    block_ends = np.nonzero(css[1:] != css[:-1])[0]
+    rs, hs = transformer.transform(lons[block_ends], lats[block_ends])
+    store["interpolate"] = create_nearest_interpolator(np.column_stack((rs, hs)), css[block_ends])
+
+    return store
 
-        prev_cs = None
-        prev_lat_lon = [None, None]
-        #data_at_cs = defaultdict()
-        for row in reader:
-            
-            # first column, climate station
-            cs = int(row[0])
-
-            # if new climate station, store the data of the old climate station
-            if prev_cs is not None and cs != prev_cs:
-
-                llat, llon = prev_lat_lon
-                #r_geoTargetGrid, h_geoTargetGrid = transform(worldGeodeticSys84, geoTargetGrid, llon, llat)
-                r_geoTargetGrid, h_geoTargetGrid = transformer.transform(llon, llat)
-                    
-                points.append([r_geoTargetGrid, h_geoTargetGrid])
-                values.append(prev_cs)
-
-            crop_id = row[3]
-            is_wintercrop = wintercrop[crop_id]
-            ilr_seed_harvest_data[crop_id]["is-winter-crop"] = is_wintercrop
-
-            base_date = date(2001, 1, 1)
-
-            sdoy = int(float(row[4]))
-            ilr_seed_harvest_data[crop_id]["data"][cs]["sowing-doy"] = sdoy
-            sd = base_date + timedelta(days = sdoy - 1)
-            ilr_seed_harvest_data[crop_id]["data"][cs]["sowing-date"] = "0000-{:02d}-{:02d}".format(sd.month, sd.day)
-
-            esdoy = int(float(row[8]))
-            ilr_seed_harvest_data[crop_id]["data"][cs]["earliest-sowing-doy"] = esdoy
-            esd = base_date + timedelta(days = esdoy - 1)
-            ilr_seed_harvest_data[crop_id]["data"][cs]["earliest-sowing-date"] = "0000-{:02d}-{:02d}".format(esd.month, esd.day)
-
-            lsdoy = int(float(row[9]))
-            ilr_seed_harvest_data[crop_id]["data"][cs]["latest-sowing-doy"] = lsdoy
-            lsd = base_date + timedelta(days = lsdoy - 1)
-            ilr_seed_harvest_data[crop_id]["data"][cs]["latest-sowing-date"] = "0000-{:02d}-{:02d}".format(lsd.month, lsd.day)
-
-            digit = 1 if is_wintercrop else 0
-            if crop_id == 'CLALF': digit = 2
-            
-            hdoy = int(float(row[6]))
-            ilr_seed_harvest_data[crop_id]["data"][cs]["harvest-doy"] = hdoy
-            hd = base_date + timedelta(days = hdoy - 1)
-            ilr_seed_harvest_data[crop_id]["data"][cs]["harvest-date"] = "000{}-{:02d}-{:02d}".format(digit, hd.month, hd.day)
-
-            ehdoy = int(float(row[10]))
-            ilr_seed_harvest_data[crop_id]["data"][cs]["earliest-harvest-doy"] = ehdoy
-            ehd = base_date + timedelta(days = ehdoy - 1)
-            ilr_seed_harvest_data[crop_id]["data"][cs]["earliest-harvest-date"] = "000{}-{:02d}-{:02d}".format(digit, ehd.month, ehd.day)
-
-            lhdoy = int(float(row[11]))
-            ilr_seed_harvest_data[crop_id]["data"][cs]["latest-harvest-doy"] = lhdoy
-            lhd = base_date + timedelta(days = lhdoy - 1)
-            ilr_seed_harvest_data[crop_id]["data"][cs]["latest-harvest-date"] = "000{}-{:02d}-{:02d}".format(digit, lhd.month, lhd.day)
-
-            lat = float(row[1])
-            lon = float(row[2])
-            prev_lat_lon = (lat, lon)      
-            prev_cs = cs
-
-        ilr_seed_harvest_data[crop_id]["interpolate"] = NearestNDInterpolator(np.array(points), np.array(values))
-
-
-def create_climate_geoGrid_interpolator_from_json_file(path_to_latlon_to_rowcol_file, worldGeodeticSys84, geoTargetGrid, cdict):
-    "create interpolator from json list of lat/lon to row/col mappings"
-    with open(path_to_latlon_to_rowcol_file) as _:
-        points = []
-        values = []
-
-        transformer = Transformer.from_crs(worldGeodeticSys84, geoTargetGrid, always_xy=True) 
-
-        for latlon, rowcol in json.load(_):
-            row, col = rowcol
-            clat, clon = latlon
-            try:
-                cr_geoTargetGrid, ch_geoTargetGrid = transformer.transform(clon, clat)
-                cdict[(row, col)] = (round(clat, 4), round(clon, 4))
-                points.append([cr_geoTargetGrid, ch_geoTargetGrid])
-                values.append((row, col))
-                #print "row:", row, "col:", col, "clat:", clat, "clon:", clon, "h:", h, "r:", r, "val:", values[i]
-            except Exception as e:
-                print("row/col:", (row,col), "clat/clon:", (clat, clon), "cr/ch:", (cr_geoTargetGrid, ch_geoTargetGrid), "Exception:", e)
-                continue
 
-        return NearestNDInterpolator(np.array(points), np.array(values))
+def create_seed_harvest_geoGrid_interpolator_and_read_data(path_to_csv_file, worldGeodeticSys84, geoTargetGrid, ilr_seed_harvest_data):
+    """read seed/harvest dates and apoint climate stations
+    the station store is kept in ilr_seed_harvest_data under its crop id"""
+
+    store = read_seed_harvest_station_store(path_to_csv_file, worldGeodeticSys84, geoTargetGrid)
+    ilr_seed_harvest_data[store["crop-id"]] = store
+    return store
+
+
+def create_seed_harvest_worksteps(ilr_store, sowing_mode, harvest_mode, sowing_ws, harvest_ws):
+    """compute the external sowing/harvest dates of a setup once per ILR station of the store
+    sowing_mode - setup["sowing-date"]: fixed, auto or fixed1 (the date of the template sowing workstep)
+    harvest_mode - setup["harvest-date"]: fixed, auto or auto1 (the latest-date of the template harvest workstep)
+    returns station id -> (values to update the sowing workstep with, values to update the harvest workstep with)"""
+
+    is_winter_crop = ilr_store["is-winter-crop"]
+    june_20_doy = date(2001, 6, 20).timetuple().tm_yday
+
+    worksteps = {}
+    for cs, i in ilr_store["index"].items():
+        if sowing_mode == "fixed":  # fixed indicates that regionally fixed sowing dates will be used
+            sowing_date = ilr_store["sowing-date"][i]
+            sdoy = int(ilr_store["sowing-doy"][i])
+        elif sowing_mode == "auto":  # auto indicates that automatic sowng dates will be used that vary between regions
+            sowing_date = ilr_store["latest-sowing-date"][i]
+            sdoy = int(ilr_store["latest-sowing-doy"][i])
+        elif sowing_mode == "fixed1":  # fixed1 indicates that a fixed sowing date will be used that is the same for entire germany
+            sowing_date = sowing_ws["date"]
+            sds = [int(x) for x in sowing_date.split("-")]
+            sdoy = date(2001, sds[1], sds[2]).timetuple().tm_yday
+        else:
+            continue
+        sowing_year = int(sowing_date[:4])
+
+        if harvest_mode == "fixed":  # fixed indicates that regionally fixed harvest dates will be used
+            harvest_date = ilr_store["harvest-date"][i]
+            hdoy = int(ilr_store["harvest-doy"][i])
+        elif harvest_mode == "auto":  # auto indicates that automatic harvest dates will be used that vary between regions
+            harvest_date = ilr_store["latest-harvest-date"][i]
+            hdoy = int(ilr_store["latest-harvest-doy"][i])
+        elif harvest_mode == "auto1":  # auto1 indicates that a fixed harvest date will be used that is the same for entire germany
+            harvest_date = harvest_ws["latest-date"]
+            hds = [int(x) for x in harvest_date.split("-")]
+            hdoy = date(2001, hds[1], hds[2]).timetuple().tm_yday
+        else:
+            continue
+        harvest_year = int(harvest_date[:4])
+
+        # sowing after harvest should probably never occur in both fixed setup!
+        if is_winter_crop:
+            calc_harvest_date = date(2000, 12, 31) + timedelta(days=min(hdoy, sdoy-1))
+        else:
+            calc_harvest_date = date(2000, 12, 31) + timedelta(days=hdoy)
+        calc_harvest_date_str = "{:04d}-{:02d}-{:02d}".format(harvest_year, calc_harvest_date.month, calc_harvest_date.day)
+
+        # the earliest sowing date is used if it is after the 20th of june
+        if int(ilr_store["earliest-sowing-doy"][i]) > june_20_doy:
+            earliest_sowing_date = ilr_store["earliest-sowing-date"][i]
+        else:
+            earliest_sowing_date = "{:04d}-{:02d}-{:02d}".format(sowing_year, 6, 20)
+
+        sowing = {}
+        harvest = {}
+        if sowing_mode == "fixed" and harvest_mode == "fixed":
+            sowing["date"] = ilr_store["sowing-date"][i]
+            harvest["date"] = calc_harvest_date_str
+        elif sowing_mode == "fixed" and harvest_mode == "auto":
+            sowing["date"] = ilr_store["sowing-date"][i]
+            harvest["latest-date"] = calc_harvest_date_str
+        elif sowing_mode == "fixed" and harvest_mode == "auto1":
+            sowing["date"] = ilr_store["sowing-date"][i]
+            harvest["latest-date"] = harvest_date
+        elif sowing_mode == "auto" and harvest_mode == "fixed":
+            calc_sowing_date = date(2000, 12, 31) + timedelta(days=max(hdoy+1, sdoy))
+            sowing["earliest-date"] = earliest_sowing_date
+            sowing["latest-date"] = "{:04d}-{:02d}-{:02d}".format(sowing_year, calc_sowing_date.month, calc_sowing_date.day)
+            harvest["date"] = ilr_store["harvest-date"][i]
+        elif sowing_mode == "auto" and harvest_mode == "auto":
+            sowing["earliest-date"] = earliest_sowing_date
+            sowing["latest-date"] = ilr_store["latest-sowing-date"][i]
+            harvest["latest-date"] = calc_harvest_date_str
+        elif sowing_mode == "fixed1" and harvest_mode == "fixed":
+            sowing["date"] = sowing_date
+            harvest["date"] = calc_harvest_date_str
+
+        worksteps[cs] = (sowing, harvest)
+
+    return worksteps
+
+
+def read_latlon_to_rowcol_columns(path_to_latlon_to_rowcol_file, worldGeodeticSys84, geoTargetGrid, use_cache=True):
+    """read a json list of lat/lon to row/col mappings as columns (row, col, lat, lon, x, y in geoTargetGrid)
+    all points are reprojected in one call, the columns are kept in a binary sidecar file
+    (<file>.<epsg>.npz) which is used as long as the json file is unchanged"""
+
+    key = json.dumps([file_key(path_to_latlon_to_rowcol_file)[1:], geoTargetGrid.to_string()])
+    path_to_npz = "{}.{}.npz".format(path_to_latlon_to_rowcol_file, geoTargetGrid.to_epsg())
+
+    if use_cache:
+        try:
+            with np.load(path_to_npz) as npz:
+                if str(npz["key"]) == key:
+                    return {col: npz[col] for col in ["row", "col", "lat", "lon", "x", "y"]}
+        except (OSError, ValueError, KeyError):
+            pass
 
+    with open(path_to_latlon_to_rowcol_file) as _:
+        latlons_rowcols = json.load(_)
+
+    lats = np.array([latlon[0] for latlon, _ in latlons_rowcols], dtype=float)
+    lons = np.array([latlon[1] for latlon, _ in latlons_rowcols], dtype=float)
+    rows = np.array([rowcol[0] for _, rowcol in latlons_rowcols], dtype=np.int64)
+    cols = np.array([rowcol[1] for _, rowcol in latlons_rowcols], dtype=np.int64)
+
+    transformer = Transformer.from_crs(worldGeodeticSys84, geoTargetGrid, always_xy=True)
+    xs, ys = transformer.transform(lons, lats)
+    is_valid = np.isfinite(xs) & np.isfinite(ys)
+    for row, col, clat, clon in zip(rows[~is_valid], cols[~is_valid], lats[~is_valid], lons[~is_valid]):
+        print("row/col:", (row, col), "clat/clon:", (clat, clon), "couldn't be transformed")
+
+    columns = {"row": rows[is_valid], "col": cols[is_valid], "lat": lats[is_valid], "lon": lons[is_valid],
+               "x": xs[is_valid], "y": ys[is_valid]}
+
+    if use_cache:
+        try:
+            tmp_path = path_to_npz + ".tmp{}".format(os.getpid())
+            with open(tmp_path, "wb") as _:
+                np.savez(_, key=np.array(key), **columns)
+            os.replace(tmp_path, path_to_npz)
+        except OSError as e:
+            print("Couldn't write latlon cache for:", path_to_latlon_to_rowcol_file, "Exception:", e)
+
+    return columns
+
+
+# (file, mtime, size, target crs) -> (interpolator, cdict), kept for the process lifetime
+climate_interpolators = {}
+
+def create_climate_geoGrid_interpolator_from_json_file(path_to_latlon_to_rowcol_file, worldGeodeticSys84, geoTargetGrid, cdict, use_cache=True):
+    """create interpolator from json list of lat/lon to row/col mappings
+    cdict is filled with (row, col) -> (lat, lon), interpolator and mapping are reused for the same file and target crs"""
+
+    key = tuple(file_key(path_to_latlon_to_rowcol_file)) + (geoTargetGrid.to_string(),)
+    if use_cache and key in climate_interpolators:
+        interpolate, cached_cdict = climate_interpolators[key]
+        cdict.update(cached_cdict)
+        return interpolate
+
+    columns = read_latlon_to_rowcol_columns(path_to_latlon_to_rowcol_file, worldGeodeticSys84, geoTargetGrid, use_cache=use_cache)
+
+    new_cdict = {}
+    for row, col, clat, clon in zip(columns["row"].tolist(), columns["col"].tolist(),
+                                    columns["lat"].tolist(), columns["lon"].tolist()):
+        new_cdict[(row, col)] = (round(clat, 4), round(clon, 4))
+
+    interpolate = create_nearest_interpolator(np.column_stack((columns["x"], columns["y"])),
+                                              np.column_stack((columns["row"], columns["col"])))
+    if use_cache:
+        climate_interpolators[key] = (interpolate, new_cdict)
+
+    cdict.update(new_cdict)
+    return interpolate
+
+
+def file_key(path_to_file):
+    "identify a file by absolute path, mtime and size, e.g. as part of a cache key"
+    stat = os.stat(path_to_file)
+    return [os.path.abspath(path_to_file), stat.st_mtime_ns, stat.st_size]
+
+
+def hash_arrays(*arrays):
+    "hash the contents of numpy arrays, e.g. cell coordinates, as part of a cache key"
+    sha = hashlib.sha1()
+    for arr in arrays:
+        arr = np.ascontiguousarray(arr)
+        sha.update(arr.dtype.str.encode())
+        sha.update(str(arr.shape).encode())
+        sha.update(arr.tobytes())
+    return sha.hexdigest()
+
+
+def balanced_row_bands(cells_per_row, band_count):
+    """split the rows of a grid into at most band_count bands of consecutive rows with about the same number of cells
+    cells_per_row - e.g. the number of non nodata cells per row
+    returns [(start row, end row)] (end row included), all rows are part of a band"""
+
+    cumulative_cells = np.cumsum(cells_per_row)
+    if len(cumulative_cells) == 0:
+        return []
+    total = cumulative_cells[-1]
+    if total == 0:
+        return [(0, len(cumulative_cells) - 1)]
+
+    # the last row of band k is the row where the cumulative cell count is closest to k/band_count of all cells
+    ends = []
+    for k in range(1, band_count):
+        target = total * k / band_count
+        end_row = int(np.searchsorted(cumulative_cells, target))
+        if end_row > 0 and target - cumulative_cells[end_row - 1] < cumulative_cells[end_row] - target:
+            end_row -= 1
+        ends.append(end_row)
+    ends.append(len(cumulative_cells) - 1)
+
+    bands = []
+    start_row = 0
+    for end_row in ends:
+        if end_row >= start_row:
+            bands.append((start_row, end_row))
+            start_row = end_row + 1
+    return bands
+
+def load_or_create_cell_table(path_to_cache_dir, name, key, create_table):
+    """load a columnar cell table (dict of column name -> 1D array, one entry per cell) from the cache dir
+    or create it by calling create_table() and store it there
+    key - json serializable description of all inputs the table depends on (files, crs, cells)"""
+
+    key_hash = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+    path_to_table = os.path.join(path_to_cache_dir, "{}_{}.npz".format(name, key_hash))
+
+    try:
+        with np.load(path_to_table) as npz:
+            return {col: npz[col] for col in npz.files}
+    except (OSError, ValueError):
+        pass
+
+    table = create_table()
+
+    try:
+        os.makedirs(path_to_cache_dir, exist_ok=True)
+        tmp_path = path_to_table + ".tmp{}".format(os.getpid())
+        with open(tmp_path, "wb") as _:
+            np.savez(_, **table)
+        os.replace(tmp_path, path_to_table)
+    except OSError as e:
+        print("Couldn't write cell table:", path_to_table, "Exception:", e)
+
+    return table
+
+
+def file_hash(path_to_file):
+    "sha1 of the contents of a file, None if it can't be read"
+    try:
+        with open(path_to_file, "rb") as _:
+            return hashlib.sha1(_.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def load_or_create_env_template(path_to_cache_dir, crop_site_sim):
+    """monica_io.create_env_json_from_json_config(crop_site_sim), stored in the cache dir
+    the key is the content of the crop/site/sim configs (incl. all changes per setup), the working dir
+    (include paths may be relative), the include file base path with expanded environment variables and the
+    code of monica_io, a stored env is only used if the files it included and the environment variables
+    used in the include paths are unchanged"""
+
+    sim = crop_site_sim.get("sim") or {}
+    base_path = monica_io.replace_env_vars(str(sim.get("include-file-base-path", "")))
+    key = [os.getcwd(), base_path, file_hash(monica_io.__file__), crop_site_sim]
+    key_hash = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+    path_to_env = os.path.join(path_to_cache_dir, "env-template_{}.json".format(key_hash))
+
+    try:
+        with open(path_to_env) as _:
+            cached = json.load(_)
+        if all(file_hash(path) == sha for path, sha in cached["includes"]) \
+                and all(os.environ.get(name) == value for name, value in cached["env-vars"].items()):
+            return cached["env"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    monica_io.included_files.clear()
+    monica_io.expanded_env_vars.clear()
+    env = monica_io.create_env_json_from_json_config(crop_site_sim)
+    if env is None:
+        return None
+
+    try:
+        os.makedirs(path_to_cache_dir, exist_ok=True)
+        tmp_path = path_to_env + ".tmp{}".format(os.getpid())
+        with open(tmp_path, "w") as _:
+            json.dump({"includes": [[path, file_hash(path)] for path in sorted(monica_io.included_files)],
+                       "env-vars": monica_io.expanded_env_vars, "env": env}, _)
+        os.replace(tmp_path, path_to_env)
+    except OSError as e:
+        print("Couldn't write env template:", path_to_env, "Exception:", e)
+
+    return env
+
+def create_json_splicer(template, slot_paths):
+    """serialize a json template once, with the values at slot_paths (slot name -> list of keys/indices into template)
+    cut out, slots whose path doesn't exist in the template are left out
+    returns splice() -> the template as json bytes, the same as json.dumps(template).encode("utf8") (zmq send_json),
+    made of the invariant parts and the current json of the slots
+    splice.refresh(name) - re-serialize the slot from the value currently at its path in template
+    splice.set_json(name, json_bytes) - set the pre-serialized json of a slot (the template isn't changed)"""
+
+    containers = {}
+    for name, path in slot_paths.items():
+        container = template
+        try:
+            for key in path[:-1]:
+                container = container[key]
+            container[path[-1]]
+        except (KeyError, IndexError, TypeError):
+            continue
+        containers[name] = (container, path[-1])
+
+    # replace the slot values by unique markers and split the serialized template at them
+    values = {}
+    markers = {}
+    for name, (container, key) in containers.items():
+        values[name] = container[key]
+        markers[json.dumps("\0slot:" + name + "\0")] = name
+        container[key] = "\0slot:" + name + "\0"
+    try:
+        text = json.dumps(template)
+    finally:
+        for name, (container, key) in containers.items():
+            container[key] = values[name]
+
+    parts = []
+    slot_order = []
+    start = 0
+    for match in re.finditer("|".join(map(re.escape, markers)), text) if markers else []:
+        parts.append(text[start:match.start()].encode("utf8"))
+        slot_order.append(markers[match.group()])
+        start = match.end()
+    parts.append(text[start:].encode("utf8"))
+
+    slot_json = {name: json.dumps(value).encode("utf8") for name, value in values.items()}
+
+    def splice():
+        chunks = [parts[0]]
+        for name, part in zip(slot_order, parts[1:]):
+            chunks.append(slot_json[name])
+            chunks.append(part)
+        return b"".join(chunks)
+
+    def refresh(name):
+        container, key = containers[name]
+        slot_json[name] = json.dumps(container[key]).encode("utf8")
+
+    def set_json(name, json_bytes):
+        slot_json[name] = json_bytes
+
+    splice.slots = list(containers.keys())
+    splice.parts = parts
+    splice.slot_order = slot_order
+    splice.slot_json = slot_json
+    splice.refresh = refresh
+    splice.set_json = set_json
+    return splice
+
+
+# multipart messages of the template plus delta env protocol, single frame messages are complete envs
+ENV_TEMPLATE = b"env-template"
+ENV_DELTA = b"env-delta"
+ENV_TEMPLATE_END = b"env-template-end"
+
+
+def env_template_frames(template_id, splice):
+    "message with the invariant parts of a splicer: [ENV_TEMPLATE, template id, json list of slot names, parts...]"
+    return [ENV_TEMPLATE, template_id, json.dumps(splice.slot_order).encode("utf8")] + splice.parts
+
+
+def create_env_delta_encoder(template_id, splice, min_ref_size=256):
+    """returns delta() -> message with the slots of splice which changed since the last delta:
+    [ENV_DELTA, template id, slot name, slot json, slot name, slot json, ...], the first delta contains all slots
+    slot values of at least min_ref_size bytes (e.g. soil profiles) are sent once, prefixing the slot name with +,
+    and later referenced by their number, prefixing the slot name with ="""
+
+    sent_slot_json = {}
+    value_refs = {}
+
+    def delta():
+        frames = [ENV_DELTA, template_id]
+        for name, value in splice.slot_json.items():
+            sent_value = sent_slot_json.get(name)
+            if sent_value is value or sent_value == value:
+                continue
+            sent_slot_json[name] = value
+            if len(value) < min_ref_size:
+                frames.append(name.encode("utf8"))
+                frames.append(value)
+            elif value in value_refs:
+                frames.append(b"=" + name.encode("utf8"))
+                frames.append(value_refs[value])
+            else:
+                value_refs[value] = str(len(value_refs)).encode()
+                frames.append(b"+" + name.encode("utf8"))
+                frames.append(value)
+        return frames
+
+    delta.template_id = template_id
+    return delta
+
+
+def create_env_expander():
+    """returns expand(frames) -> the complete env (json bytes) of a single frame or ENV_DELTA message
+    or None for ENV_TEMPLATE/ENV_TEMPLATE_END messages, which (un)register a template
+    the messages of one template have to arrive in the order they were sent (one zmq connection)
+    ENV_DELTA messages of an unknown template (e.g. after a restart of the expander) are dropped (None),
+    their number is counted in expand.dropped_env_count"""
+
+    templates = {}
+    unknown_template_ids = set()
+
+    def expand(frames):
+        if len(frames) == 1:
+            return frames[0]
+
+        msg_type, template_id = frames[0], frames[1]
+        if msg_type == ENV_TEMPLATE:
+            templates[template_id] = (frames[3:], json.loads(frames[2]), {}, [])
+            return None
+        elif msg_type == ENV_TEMPLATE_END:
+            templates.pop(template_id, None)
+            return None
+        elif msg_type == ENV_DELTA:
+            if template_id not in templates:
+                if template_id not in unknown_template_ids:
+                    unknown_template_ids.add(template_id)
+                    print("dropping the envs of unknown env template:", template_id)
+                expand.dropped_env_count += 1
+                return None
+            parts, slot_order, slot_json, values = templates[template_id]
+            for name, value in zip(frames[2::2], frames[3::2]):
+                if name[:1] == b"+":
+                    values.append(value)
+                    name = name[1:]
+                elif name[:1] == b"=":
+                    value = values[int(value)]
+                    name = name[1:]
+                slot_json[name.decode("utf8")] = value
+            chunks = [parts[0]]
+            for name, part in zip(slot_order, parts[1:]):
+                chunks.append(slot_json[name])
+                chunks.append(part)
+            return b"".join(chunks)
+
+        raise ValueError("unknown env message type: " + str(msg_type))
+
+    expand.templates = templates
+    expand.dropped_env_count = 0
+    return expand
+
+
+# name -> (compress(bytes) -> bytes, decompress(bytes) -> bytes) of the codecs for compressed messages,
+# further codecs can be added (on the sending and the receiving side)
+CODECS = {
+    "zlib": (zlib.compress, zlib.decompress),
+    "lzma": (lzma.compress, lzma.decompress)
+}
+
+# first frame of a compressed message, followed by the codec name,
+# the second frame are the original frames (each prefixed by its length as 4 byte little endian int) compressed together
+CODEC_HEADER = b"codec:"
+
+
+def encode_frames(frames, codec=None):
+    "compress the frames of a message with a codec from CODECS, an empty codec leaves them as they are"
+    if not codec:
+        return frames
+    compress = CODECS[codec][0]
+    data = b"".join(struct.pack("<I", len(frame)) + frame for frame in frames)
+    return [CODEC_HEADER + codec.encode("utf8"), compress(data)]
+
+
+def decode_frames(frames):
+    "the original frames of a message, compressed (see encode_frames) or not"
+    if len(frames) != 2 or not frames[0].startswith(CODEC_HEADER):
+        return frames
+    decompress = CODECS[frames[0][len(CODEC_HEADER):].decode("utf8")][1]
+    data = decompress(frames[1])
+    decoded = []
+    pos = 0
+    while pos < len(data):
+        size = struct.unpack_from("<I", data, pos)[0]
+        decoded.append(data[pos + 4:pos + 4 + size])
+        pos += 4 + size
+    return decoded
+
+
+def recv_json(socket):
+    "socket.recv_json() which also understands compressed messages"
+    return json.loads(decode_frames(socket.recv_multipart())[0])
@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+# relays messages between a PULL and a PUSH socket, decompressing compressed messages (see Mrunlib.encode_frames)
+# and compressing them again with "codec" (empty = send them uncompressed), e.g.
+# envs for the MONICA workers, which don't understand compressed messages, next to the monica-zmq-proxy:
+# run_producer.py compression=zlib server-port=6665
+# run_codec_relay.py in=tcp://*:6665 in-bind=true out=tcp://localhost:6666 out-bind=false
+# results for a remote consumer (run_consumer.py port=7778), next to the monica-zmq-proxy:
+# run_codec_relay.py in=tcp://localhost:7777 in-bind=false out=tcp://*:7778 out-bind=true codec=zlib
+
+import sys
+import zmq
+
+import monica_run_lib as Mrunlib
+
+
+# commandline parameters e.g "in=tcp://*:6665 in-bind=true out=tcp://localhost:6666 out-bind=false codec="
+def run_codec_relay():
+    config = {
+        "in": "tcp://*:6665",
+        "in-bind": "true", # bind or connect the in (PULL) socket
+        "out": "tcp://localhost:6666",
+        "out-bind": "false", # bind or connect the out (PUSH) socket
+        "codec": "", # codec (Mrunlib.CODECS) to compress the relayed messages with, empty = uncompressed
+        "timeout": "-1" # ms without messages until exiting, -1 = run forever
+    }
+
+    if len(sys.argv) > 1 and __name__ == "__main__":
+        for arg in sys.argv[1:]:
+            k, v = arg.split("=")
+            if k in config:
+                config[k] = v
+
+    print("config:", config)
+
+    context = zmq.Context()
+    in_socket = context.socket(zmq.PULL)
+    out_socket = context.socket(zmq.PUSH)
+    for socket, address, bind in [(in_socket, config["in"], config["in-bind"]), (out_socket, config["out"], config["out-bind"])]:
+        if bind.lower() == "true":
+            socket.bind(address)
+        else:
+            socket.connect(address)
+    in_socket.RCVTIMEO = int(config["timeout"])
+
+    relayed_count = 0
+    received_bytes = 0
+    sent_bytes = 0
+    while True:
+        try:
+            frames = in_socket.recv_multipart()
+        except zmq.error.Again:
+            print("no message (with \"timeout\"=%d ms)" % in_socket.RCVTIMEO)
+            break
+
+        out_frames = Mrunlib.encode_frames(Mrunlib.decode_frames(frames), config["codec"])
+        out_socket.send_multipart(out_frames, copy=False)
+        received_bytes += sum(map(len, frames))
+        sent_bytes += sum(map(len, out_frames))
+        relayed_count += 1
+        if relayed_count % 1000 == 0:
+            print("relayed", relayed_count, "messages,", received_bytes, "bytes received,", sent_bytes, "bytes sent")
+
+    print("relayed", relayed_count, "messages,", received_bytes, "bytes received,", sent_bytes, "bytes sent")
+    in_socket.close()
+    out_socket.close()
+    context.term()
+
+
+if __name__ == "__main__":
+    run_codec_relay()
@@ -22,7 +22,7 @@ import gc
 import json
 import numpy as np
 import os
-from pyproj import CRS, Transformer
+from pyproj import CRS
 import sqlite3
 import sys
 import timeit
@@ -273,40 +273,19 @@ def run_consumer(leave_after_finished_run=True, server=None, port=None):
     soil_epsg_code = int(path_to_soil_grid.split("/")[-1].split("_")[2])
     soil_crs = CRS.from_epsg(soil_epsg_code)
     soil_metadata, header = Mrunlib.read_header(path_to_soil_grid)
-    soil_grid_template = np.loadtxt(path_to_soil_grid, dtype=int, skiprows=6)
+    soil_grid_template = Mrunlib.load_ascii_grid(path_to_soil_grid, dtype=int, mmap_mode="c")
 
-    scols = int(soil_metadata["ncols"])
-    srows = int(soil_metadata["nrows"])
-    scellsize = int(soil_metadata["cellsize"])
-    xllcorner = int(soil_metadata["xllcorner"])
-    yllcorner = int(soil_metadata["yllcorner"])
     nodata_value = int(soil_metadata["nodata_value"])
 
     if USE_LANDUSE:
         path_to_landuse_grid = TEMPLATE_LANDUSE_PATH.format(local_path_to_data_dir=paths["path-to-data-dir"])
         landuse_epsg_code = int(path_to_landuse_grid.split("/")[-1].split("_")[2])
         landuse_crs = CRS.from_epsg(landuse_epsg_code)
-        landuse_transformer = Transformer.from_crs(soil_crs, landuse_crs)
-        landuse_meta, _ = Mrunlib.read_header(path_to_landuse_grid)
-        landuse_grid = np.loadtxt(path_to_landuse_grid, dtype=int, skiprows=6)
-        landuse_interpolate = Mrunlib.create_ascii_grid_interpolator(landuse_grid, landuse_meta)
-
-        for srow in range(0, srows):
-            #print(srow)
-            for scol in range(0, scols):
-                soil_id = soil_grid_template[srow, scol]
-                if soil_id == -9999:
-                    continue
-
-                #get coordinate of clostest climate element of real soil-cell
-                sh = yllcorner + (scellsize / 2) + (srows - srow - 1) * scellsize
-                sr = xllcorner + (scellsize / 2) + scol * scellsize
+        landuse_grid, _ = Mrunlib.load_or_create_aligned_ascii_grid(path_to_landuse_grid, landuse_crs,
+                                                                   path_to_soil_grid, soil_crs)
 
-                # check if current grid cell is used for agriculture                
-                lur, luh = landuse_transformer(sh, sr)
-                landuse_id = landuse_interpolate(lur, luh)
-                if landuse_id not in [2,3,4]:
-                    soil_grid_template[srow, scol] = -9999
+        # check if grid cells are used for agriculture
+        soil_grid_template[~np.isin(landuse_grid, [2,3,4])] = -9999
 
         print("filtered through CORINE")
 
@@ -466,7 +445,7 @@ def run_consumer(leave_after_finished_run=True, server=None, port=None):
 
     while not leave:
         try:
-            msg = socket.recv_json() #encoding="latin-1"
+            msg = Mrunlib.recv_json(socket) #encoding="latin-1"
             leave = process_message(msg)
         except zmq.error.Again as _e:
             print('no response from the server (with "timeout"=%d ms) ' % socket.RCVTIMEO)
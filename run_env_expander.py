@@ -0,0 +1,90 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+# expands the envs of run_producer.py env-protocol=delta (template + per cell deltas) to complete envs,
+# runs next to the workers, between the producer and the input of monica-zmq-proxy,
+# the producer messages may be compressed (run_producer.py compression=zlib):
+# run_producer.py env-protocol=delta server=<expander host> server-port=6665
+# run_env_expander.py in-port=6665 server=localhost server-port=6666
+
+import sys
+import time
+import zmq
+
+import monica_run_lib as Mrunlib
+
+
+# commandline parameters e.g "in-port=6665 server=localhost server-port=6666"
+def run_env_expander():
+    config = {
+        "in-port": "6665", # the producer connects to this port
+        "server": "localhost", # input of monica-zmq-proxy
+        "server-port": "6666",
+        "compression": "", # codec to compress the expanded envs with, the MONICA workers need them uncompressed
+        "timeout": "-1" # ms without messages until exiting, -1 = run forever
+    }
+
+    if len(sys.argv) > 1 and __name__ == "__main__":
+        for arg in sys.argv[1:]:
+            k, v = arg.split("=")
+            if k in config:
+                config[k] = v
+
+    print("config:", config)
+
+    context = zmq.Context()
+    in_socket = context.socket(zmq.PULL)
+    in_socket.bind("tcp://*:" + config["in-port"])
+    in_socket.RCVTIMEO = int(config["timeout"])
+    out_socket = context.socket(zmq.PUSH)
+    out_socket.connect("tcp://" + config["server"] + ":" + config["server-port"])
+
+    expand = Mrunlib.create_env_expander()
+    received_bytes = 0
+    sent_bytes = 0
+    sent_env_count = 0
+    start_time = time.perf_counter()
+    while True:
+        try:
+            frames = in_socket.recv_multipart()
+        except zmq.error.Again:
+            print("no message from the producer (with \"timeout\"=%d ms)" % in_socket.RCVTIMEO)
+            break
+
+        received_bytes += sum(map(len, frames))
+        env = expand(Mrunlib.decode_frames(frames))
+        if env is None:
+            continue
+
+        out_frames = Mrunlib.encode_frames([env], config["compression"])
+        out_socket.send_multipart(out_frames, copy=False)
+        sent_bytes += sum(map(len, out_frames))
+        sent_env_count += 1
+        if sent_env_count % 1000 == 0:
+            print("expanded", sent_env_count, "envs,", received_bytes, "bytes received,", sent_bytes, "bytes sent")
+
+    print("expanded", sent_env_count, "envs,", received_bytes, "bytes received,", sent_bytes, "bytes sent in",
+          time.perf_counter() - start_time, "seconds")
+    if expand.dropped_env_count > 0:
+        print("dropped", expand.dropped_env_count, "envs of unknown env templates")
+    in_socket.close()
+    out_socket.close()
+    context.term()
+
+
+if __name__ == "__main__":
+    run_env_expander()
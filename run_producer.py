@@ -15,22 +15,16 @@
 # Landscape Systems Analysis at the ZALF.
 # Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
 
-from collections import defaultdict
-import copy
-import csv
-from datetime import date, timedelta
+from concurrent.futures import ProcessPoolExecutor
 import json
-import math
 import numpy as np
 import os
 from pyproj import CRS, Transformer
-import sqlite3
-import sqlite3 as cas_sq3
 import sys
 import time
+import uuid
 import zmq
 
-import monica_io
 import soil_io
 import monica_run_lib as Mrunlib
 
@@ -42,6 +36,7 @@ PATHS = {
         "monica-path-to-climate-dir": "/monica_data/climate-data/", # mounted path to archive accessable by monica executable
         "path-to-data-dir": "./data/", # mounted path to archive or hard drive with data
         "path-debug-write-folder": "./debug-out/",
+        "path-to-cache-dir": "./cache/", # cell tables and other precomputed data
         "path-to-100-climate-files": "C:/Users/palka/Documents/weather_data/pr_output_csvs/"
     },
     "mbm-local-remote": {
@@ -50,6 +45,7 @@ PATHS = {
         "monica-path-to-climate-dir": "/monica_data/climate-data/", # mounted path to archive accessable by monica executable
         "path-to-data-dir": "./data/", # mounted path to archive or hard drive with data
         "path-debug-write-folder": "./debug-out/",
+        "path-to-cache-dir": "./cache/", # cell tables and other precomputed data
         "path-to-100-climate-files": "/home/berg/Desktop/marlene/pr_output_csvs/"
     },
     "remoteProducer-remoteMonica": {
@@ -58,6 +54,7 @@ PATHS = {
         "monica-path-to-climate-dir": "/monica_data/climate-data/", # mounted path to archive accessable by monica executable
         "path-to-data-dir": "./data/", # mounted path to archive or hard drive with data 
         "path-debug-write-folder": "/out/debug-out/",
+        "path-to-cache-dir": "/out/cache/", # cell tables and other precomputed data
     }
 }
 
@@ -80,65 +77,424 @@ DEBUG_ROWS = 10
 DEBUG_WRITE_FOLDER = "./debug_out"
 DEBUG_WRITE_CLIMATE = False
 
-# commandline parameters e.g "server=localhost port=6666 shared_id=2"
-def run_producer(server = {"server": None, "port": None}, shared_id = None):
-    context = zmq.Context()
-    socket = context.socket(zmq.PUSH)  # pylint: disable=no-member
+def get_sowing_and_harvest_worksteps(env_template):
+    "the sowing and harvest workstep of the first crop rotation of the env"
+    worksteps = env_template["cropRotation"][0]["worksteps"]
+    sowing_ws = next(filter(lambda ws: ws["type"][-6:] == "Sowing", worksteps))
+    harvest_ws = next(filter(lambda ws: ws["type"][-7:] == "Harvest", worksteps))
+    return sowing_ws, harvest_ws
 
-    config = {
-        "mode": "mp-local-remote", ## local:"cj-local-remote" remote "mbm-local-remote"
-        "server-port": server["port"] if server["port"] else "6666", ## local: 6667, remote 6666
-        "server": server["server"] if server["server"] else "localhost",  # "login01.cluster.zalf.de",
-        "start-row": "0", 
-        "end-row": "-1", 
-        "path_to_dem_grid": "",
-        "sim.json": "sim.json",
-        "crop.json": "crop.json",
-        "site.json": "site.json",
-        "setups-file": "sim_setups.csv",
-        "run-setups": "[1]",
-        "shared_id": shared_id
+
+def prepare_setup(setup_id, setup, config, paths, cells, cells_key, soil_crs, ilr_seed_harvest_data):
+    """everything a setup needs before its envs can be created: the cell tables of the ILR stations and climate cells,
+    the env template and the sowing/harvest dates per ILR station, None if the setup can't be run
+    ilr_seed_harvest_data - crop id -> ILR station store, read once per crop and process"""
+
+    wgs84_crs = CRS.from_epsg(4326)
+    utm32_crs = CRS.from_epsg(25832)
+
+    scenario = setup["scenario"]
+    crop_id = setup["crop-id"]
+
+    ## extract crop_id from crop-id name that has possible an extenstion
+    crop_id_short = crop_id.split('_')[0]
+
+    # add crop id from setup file
+    try:
+        #read seed/harvest dates for each crop_id
+        path_harvest = TEMPLATE_PATH_HARVEST.format(path_to_data_dir=paths["path-to-data-dir"],  crop_id=crop_id_short)
+        if crop_id_short not in ilr_seed_harvest_data:
+            print("created seed harvest gk5 interpolator and read data: ", path_harvest)
+            Mrunlib.create_seed_harvest_geoGrid_interpolator_and_read_data(path_harvest, wgs84_crs, utm32_crs, ilr_seed_harvest_data)
+    except IOError:
+        path_harvest = TEMPLATE_PATH_HARVEST.format(path_to_data_dir=paths["path-to-data-dir"],  crop_id=crop_id_short)
+        print("Couldn't read file:", path_harvest)
+        return None
+
+    # closest ILR station per cell, 0 if there is none
+    def create_ilr_cell_table():
+        ilr_interpolate = ilr_seed_harvest_data.get(crop_id_short, {}).get("interpolate")
+        if ilr_interpolate:
+            return {"seed_harvest_cs": ilr_interpolate(cells["sr"], cells["sh"])}
+        return {"seed_harvest_cs": np.zeros(len(cells["sr"]), dtype=int)}
+
+    ilr_cells = Mrunlib.load_or_create_cell_table(paths["path-to-cache-dir"], "ilr-cells", {
+        "csv": Mrunlib.file_key(path_harvest),
+        "crop_id": crop_id_short,
+        "crs": utm32_crs.to_string(),
+        "cells": cells_key
+    }, create_ilr_cell_table)
+
+    # closest climate row/col and its latitude per cell
+    path = TEMPLATE_PATH_LATLON.format(path_to_climate_dir=paths["path-to-climate-dir"] + setup["climate_path_to_latlon_file"] + "/")
+
+    def create_climate_cell_table():
+        cdict = {}
+        climate_data_interpolator = Mrunlib.create_climate_geoGrid_interpolator_from_json_file(path, wgs84_crs, soil_crs, cdict)
+        print("created climate_data to gk5 interpolator: ", path)
+        #get coordinate of clostest climate element of real soil-cell
+        crows_ccols = climate_data_interpolator(cells["sr"], cells["sh"]).reshape((-1, 2))
+        return {
+            "crow": crows_ccols[:, 0],
+            "ccol": crows_ccols[:, 1],
+            "clat": np.array([cdict[(crow, ccol)][0] for crow, ccol in crows_ccols.tolist()], dtype=float)
+        }
+
+    climate_cells = Mrunlib.load_or_create_cell_table(paths["path-to-cache-dir"], "climate-cells", {
+        "latlon": Mrunlib.file_key(path),
+        "crs": soil_crs.to_string(),
+        "cells": cells_key
+    }, create_climate_cell_table)
+
+    # read template sim.json 
+    with open(setup.get("sim.json", config["sim.json"])) as _:
+        sim_json = json.load(_)
+    # change start and end date acording to setup
+    if setup["start_date"]:
+        sim_json["climate.csv-options"]["start-date"] = str(setup["start_date"])
+    if setup["end_date"]:
+        sim_json["climate.csv-options"]["end-date"] = str(setup["end_date"]) 
+    #sim_json["include-file-base-path"] = paths["include-file-base-path"]
+
+    # read template site.json
+    with open(setup.get("site.json", config["site.json"])) as _:
+        site_json = json.load(_)
+
+    if len(scenario) > 0 and scenario[:3].lower() == "rcp":
+        site_json["EnvironmentParameters"]["rcp"] = scenario
+
+    # read template crop.json
+    with open(setup.get("crop.json", config["crop.json"])) as _:
+        crop_json = json.load(_)
+
+    crop_json["CropParameters"]["__enable_vernalisation_factor_fix__"] = setup["use_vernalisation_fix"] if "use_vernalisation_fix" in setup else False
+
+    # set the current crop used for this run id
+    crop_json["cropRotation"][2] = crop_id
+
+    # create environment template from json templates, stored in the cache dir for later runs
+    env_template = Mrunlib.load_or_create_env_template(paths["path-to-cache-dir"], {
+        "crop": crop_json,
+        "site": site_json,
+        "sim": sim_json,
+        "climate": ""
+    })
+
+    sowing_ws, harvest_ws = get_sowing_and_harvest_worksteps(env_template)
+
+    # external sowing/harvest dates of this setup per ILR station
+    seed_harvest_worksteps = {}
+    if crop_id_short in ilr_seed_harvest_data:
+        seed_harvest_worksteps = Mrunlib.create_seed_harvest_worksteps(ilr_seed_harvest_data[crop_id_short],
+                                                                       setup["sowing-date"], setup["harvest-date"],
+                                                                       sowing_ws, harvest_ws)
+
+
+    return {
+        "ilr_cells": ilr_cells,
+        "climate_cells": climate_cells,
+        "sim_json": sim_json,
+        "env_template": env_template,
+        "seed_harvest_worksteps": seed_harvest_worksteps
     }
-    
-    # read commandline args only if script is invoked directly from commandline
-    if len(sys.argv) > 1 and __name__ == "__main__":
-        for arg in sys.argv[1:]:
-            k, v = arg.split("=")
-            if k in config:
-                config[k] = v
 
-    print("config:", config)
 
-    # select paths 
-    paths = PATHS[config["mode"]]
-    # open soil db connection
-    soil_db_con = sqlite3.connect(paths["path-to-data-dir"] + DATA_SOIL_DB)
-    socket.connect("tcp://" + config["server"] + ":" + str(config["server-port"]))
+# the data shared by all setups in the processes of the setup-workers pool, see init_setup_worker
+setup_worker_data = {}
+
+
+def init_setup_worker(config, paths, cells, cells_key, soil_crs):
+    "initialize a process of the setup-workers pool"
+    setup_worker_data.update({
+        "config": config,
+        "paths": paths,
+        "cells": cells,
+        "cells_key": cells_key,
+        "soil_crs": soil_crs,
+        "ilr_seed_harvest_data": {}
+    })
+
+
+def prepare_setup_in_worker(setup_id, setup):
+    "prepare_setup in a process of the setup-workers pool"
+    d = setup_worker_data
+    return prepare_setup(setup_id, setup, d["config"], d["paths"], d["cells"], d["cells_key"], d["soil_crs"],
+                         d["ilr_seed_harvest_data"])
+
+
+def gen_setup_env_frames(setup_id, setup, prepared, cells, soil_db_con, config, paths, start_setup_time):
+    """yield the messages (list of frames) with the envs of all cells of a prepared setup (see prepare_setup)
+    returns the number of envs"""
+
+    gcm = setup["gcm"]
+    rcm = setup["rcm"]
+    scenario = setup["scenario"]
+    ensmem = setup["ensmem"]
+    version = setup["version"]
+
+    ilr_cells = prepared["ilr_cells"]
+    climate_cells = prepared["climate_cells"]
+    sim_json = prepared["sim_json"]
+    env_template = prepared["env_template"]
+    seed_harvest_worksteps = prepared["seed_harvest_worksteps"]
+    worksteps = env_template["cropRotation"][0]["worksteps"]
+    sowing_ws, harvest_ws = get_sowing_and_harvest_worksteps(env_template)
+
+    # the env is serialized once per setup and only the fields which change per cell are spliced in,
+    # the serialization is created at the first cell with data, when the template contains all of these fields
+    cell_slot_paths = {
+        "customId": ["customId"],
+        "SoilProfileParameters": ["params", "siteParameters", "SoilProfileParameters"],
+        "sowing_ws": ["cropRotation", 0, "worksteps", [ws is sowing_ws for ws in worksteps].index(True)],
+        "harvest_ws": ["cropRotation", 0, "worksteps", [ws is harvest_ws for ws in worksteps].index(True)],
+        "MinGroundwaterDepth": ["params", "userEnvironmentParameters", "MinGroundwaterDepth"],
+        "MaxGroundwaterDepth": ["params", "userEnvironmentParameters", "MaxGroundwaterDepth"],
+        "LeachingDepth": ["params", "userEnvironmentParameters", "LeachingDepth"],
+        "ImpenetrableLayerDepth": ["params", "siteParameters", "ImpenetrableLayerDepth"],
+        "heightNN": ["params", "siteParameters", "heightNN"],
+        "slope": ["params", "siteParameters", "slope"],
+        "Latitude": ["params", "siteParameters", "Latitude"],
+        "pathToClimateCSV": ["pathToClimateCSV"]
+    }
+    env_splicer = None
+    env_delta = None
+    cell_value_slots = []
+    # ILR station of the sowing/harvest dates in env_template and in env_splicer
+    template_ws_cs = spliced_ws_cs = None
+
+    def env_messages():
+        """the messages to send env_template: the json bytes, spliced if the serialization of the setup exists,
+        or with env-protocol=delta the delta to the template (preceded by the template before the first delta)"""
+        nonlocal spliced_ws_cs, env_delta
+        if env_splicer is None:
+            return [[json.dumps(env_template).encode("utf8")]]
+        if spliced_ws_cs != template_ws_cs:
+            env_splicer.refresh("sowing_ws")
+            env_splicer.refresh("harvest_ws")
+            spliced_ws_cs = template_ws_cs
+        env_splicer.refresh("customId")
+        if config["env-protocol"] != "delta":
+            return [[env_splicer()]]
+        messages = []
+        if env_delta is None:
+            template_id = uuid.uuid4().hex.encode()
+            env_delta = Mrunlib.create_env_delta_encoder(template_id, env_splicer)
+            messages.append(Mrunlib.env_template_frames(template_id, env_splicer))
+        messages.append(env_delta())
+        return messages
+
+    sent_env_count = 0
+    for file_name, soil_id, crop_grid_id, is_landcover, height_nn, slope, crow, ccol, clat, seed_harvest_cs in zip(
+            cells["file_name"].tolist(), cells["soil_id"].tolist(), cells["crop_grid_id"].tolist(),
+            cells["is_landcover"].tolist(), cells["height"].tolist(), cells["slope"].tolist(),
+            climate_cells["crow"].tolist(), climate_cells["ccol"].tolist(), climate_cells["clat"].tolist(),
+            ilr_cells["seed_harvest_cs"].tolist()):
+
+        # print(crop_grid_id)
+        if crop_grid_id != 1:
+            # print("row/col:", srow, "/", scol, "is not a crop pixel.")
+            env_template["customId"] = {
+                "setup_id": setup_id,
+                "crow": int(crow), "ccol": int(ccol),
+                "soil_id": soil_id,
+                "env_id": sent_env_count,
+                "nodata": True
+            }
+            if not DEBUG_DONOT_SEND:
+                yield from env_messages()
+                # print("sent nodata env ", sent_env_count, " customId: ", env_template["customId"])
+                sent_env_count += 1
+            continue
 
-    # read setup from csv file
-    setups = Mrunlib.read_sim_setups(config["setups-file"])
-    run_setups = json.loads(config["run-setups"])
-    print("read sim setups: ", config["setups-file"])
+        soil_profile = soil_io.cached_soil_parameters(soil_db_con, soil_id)
+
+        if len(soil_profile) == 0:
+            env_template["customId"] = {
+                "setup_id": setup_id,
+                "crow": int(crow), "ccol": int(ccol),
+                "soil_id": soil_id,
+                "env_id": sent_env_count,
+                "nodata": True
+            }
+            if not DEBUG_DONOT_SEND:
+                yield from env_messages()
+                # print("sent nodata env ", sent_env_count, " customId: ", env_template["customId"])
+                sent_env_count += 1
+            continue
+
+        # set external seed/harvest dates
+        if seed_harvest_cs in seed_harvest_worksteps:
+            sowing_values, harvest_values = seed_harvest_worksteps[seed_harvest_cs]
+            sowing_ws.update(sowing_values)
+            harvest_ws.update(harvest_values)
+            template_ws_cs = seed_harvest_cs
+
+        # check if current grid cell is used for agriculture
+        if setup["landcover"]:
+            if not is_landcover:
+                continue
+
+        env_template["params"]["userCropParameters"]["__enable_T_response_leaf_expansion__"] = setup["LeafExtensionModifier"]
+
+        #print("soil:", soil_profile)
+        env_template["params"]["siteParameters"]["SoilProfileParameters"] = soil_profile
+
+        # groundwater and impenetrable layer depth are derived once per soil profile
+        soil_site = soil_io.cached_soil_site_fragment(soil_db_con, soil_id)
+
+        # setting groundwater level
+        if setup["groundwater-level"]:
+            groundwaterlevel = soil_site["groundwater-depth"]
+            if groundwaterlevel is None:
+                groundwaterlevel = 20
+            env_template["params"]["userEnvironmentParameters"]["MinGroundwaterDepthMonth"] = 3
+            env_template["params"]["userEnvironmentParameters"]["MinGroundwaterDepth"] = [max(0, groundwaterlevel - 0.2) , "m"]
+            env_template["params"]["userEnvironmentParameters"]["MaxGroundwaterDepth"] = [groundwaterlevel + 0.2, "m"]
+
+        # setting impenetrable layer
+        if setup["impenetrable-layer"]:
+            impenetrable_layer_depth = soil_site["impenetrable-layer-depth"]
+            if impenetrable_layer_depth is None:
+                impenetrable_layer_depth = Mrunlib.get_value(env_template["params"]["userEnvironmentParameters"]["LeachingDepth"])
+            env_template["params"]["userEnvironmentParameters"]["LeachingDepth"] = [impenetrable_layer_depth, "m"]
+            env_template["params"]["siteParameters"]["ImpenetrableLayerDepth"] = [impenetrable_layer_depth, "m"]
+
+        if setup["elevation"]:
+            env_template["params"]["siteParameters"]["heightNN"] = float(height_nn)
+
+        if setup["slope"]:
+            env_template["params"]["siteParameters"]["slope"] = slope / 100.0
+
+        if setup["latitude"]:
+            env_template["params"]["siteParameters"]["Latitude"] = clat
+
+        if setup["CO2"]:
+            env_template["params"]["userEnvironmentParameters"]["AtmosphericCO2"] = float(setup["CO2"])
+
+        if setup["O3"]:
+            env_template["params"]["userEnvironmentParameters"]["AtmosphericO3"] = float(setup["O3"])
+
+        if setup["FieldConditionModifier"]:
+            env_template["cropRotation"][0]["worksteps"][0]["crop"]["cropParams"]["species"]["FieldConditionModifier"] = float(setup["FieldConditionModifier"])
+
+        if setup["StageTemperatureSum"]:
+            stage_ts = setup["StageTemperatureSum"].split('_')
+            stage_ts = [int(temp_sum) for temp_sum in stage_ts]
+            orig_stage_ts = env_template["cropRotation"][0]["worksteps"][0]["crop"]["cropParams"]["cultivar"][
+                "StageTemperatureSum"][0]
+            if len(stage_ts) != len(orig_stage_ts):
+                stage_ts = orig_stage_ts
+                print('The provided StageTemperatureSum array is not '
+                      'sufficiently long. Falling back to original StageTemperatureSum')
+
+            env_template["cropRotation"][0]["worksteps"][0]["crop"]["cropParams"]["cultivar"][
+                "StageTemperatureSum"][0] = stage_ts
+
+        env_template["params"]["simulationParameters"]["UseNMinMineralFertilisingMethod"] = setup["fertilization"]
+        env_template["params"]["simulationParameters"]["UseAutomaticIrrigation"] = setup["irrigation"]
+
+        env_template["params"]["simulationParameters"]["NitrogenResponseOn"] = setup["NitrogenResponseOn"]
+        env_template["params"]["simulationParameters"]["WaterDeficitResponseOn"] = setup["WaterDeficitResponseOn"]
+        env_template["params"]["simulationParameters"]["EmergenceMoistureControlOn"] = setup["EmergenceMoistureControlOn"]
+        env_template["params"]["simulationParameters"]["EmergenceFloodingControlOn"] = setup["EmergenceFloodingControlOn"]
+
+        env_template["csvViaHeaderOptions"] = sim_json["climate.csv-options"]
+
+        if file_name:
+            env_template["pathToClimateCSV"] = paths["path-to-100-climate-files"] + "/" + file_name
+        else:
+            subpath_to_csv = TEMPLATE_PATH_CLIMATE_CSV.format(gcm=gcm, rcm=rcm, scenario=scenario, ensmem=ensmem, version=version, crow=str(crow), ccol=str(ccol))
+            for _ in range(4):
+                subpath_to_csv = subpath_to_csv.replace("//", "/")
+            env_template["pathToClimateCSV"] = [paths["monica-path-to-climate-dir"] + setup["climate_path_to_csvs"] + "/" + subpath_to_csv]
+            if setup["incl_hist"]:
+
+                if rcm[:3] == "UHO":
+                    hist_subpath_to_csv = TEMPLATE_PATH_CLIMATE_CSV.format(gcm=gcm, rcm="CLMcom-CCLM4-8-17", scenario="historical", ensmem=ensmem, version=version, crow=str(crow), ccol=str(ccol))
+                    for _ in range(4):
+                        hist_subpath_to_csv = hist_subpath_to_csv.replace("//", "/")
+                    env_template["pathToClimateCSV"].insert(0, paths["monica-path-to-climate-dir"] + setup["climate_path_to_csvs"] + "/" + hist_subpath_to_csv)
+
+                elif rcm[:3] == "SMH":
+                    hist_subpath_to_csv = TEMPLATE_PATH_CLIMATE_CSV.format(gcm=gcm, rcm="CLMcom-CCLM4-8-17", scenario="historical", ensmem=ensmem, version=version, crow=str(crow), ccol=str(ccol))
+                    for _ in range(4):
+                        hist_subpath_to_csv = hist_subpath_to_csv.replace("//", "/")
+                    env_template["pathToClimateCSV"].insert(0, paths["monica-path-to-climate-dir"] + setup["climate_path_to_csvs"] + "/" + hist_subpath_to_csv)
+
+                hist_subpath_to_csv = TEMPLATE_PATH_CLIMATE_CSV.format(gcm=gcm, rcm=rcm, scenario="historical", ensmem=ensmem, version=version, crow=str(crow), ccol=str(ccol))
+                for _ in range(4):
+                    hist_subpath_to_csv = hist_subpath_to_csv.replace("//", "/")
+                env_template["pathToClimateCSV"].insert(0, paths["monica-path-to-climate-dir"] + setup["climate_path_to_csvs"] + "/" + hist_subpath_to_csv)
+        print("pathToClimateCSV:", env_template["pathToClimateCSV"])
+
+        env_template["customId"] = {
+            "setup_id": setup_id,
+            "crow": int(crow), "ccol": int(ccol),
+            "soil_id": soil_id,
+            "env_id": sent_env_count,
+            "nodata": False
+        }
+
+        if env_splicer is None:
+            env_splicer = Mrunlib.create_json_splicer(env_template, cell_slot_paths)
+            cell_value_slots = [name for name in cell_slot_paths if name in env_splicer.slots
+                                and name not in ["customId", "SoilProfileParameters", "sowing_ws", "harvest_ws"]]
+            spliced_ws_cs = template_ws_cs
+        else:
+            env_splicer.set_json("SoilProfileParameters", soil_site["profile-json"])
+            for name in cell_value_slots:
+                env_splicer.refresh(name)
+        messages = env_messages()
+
+        if not DEBUG_DONOT_SEND :
+            yield from messages
+            print("sent env ", sent_env_count, " customId: ", env_template["customId"])
+
+        sent_env_count += 1
+
+        # write debug output, as json file
+        if DEBUG_WRITE:
+            debug_write_folder = paths["path-debug-write-folder"]
+            if not os.path.exists(debug_write_folder):
+                os.makedirs(debug_write_folder)
+            if sent_env_count < DEBUG_ROWS:
+
+                path_to_debug_file = f"{debug_write_folder}/sid-{setup_id}_crow-{crow}_ccol-{ccol}.json"
+
+                if not os.path.isfile(path_to_debug_file):
+                    with open(path_to_debug_file, "wb") as _ :
+                        _.write(messages[-1][0] if len(messages[-1]) == 1 else env_splicer())
+                else:
+                    print("WARNING: Row ", (sent_env_count-1), " already exists")
+        #print("unknown_soil_ids:", unknown_soil_ids)
+
+        #print("crows/cols:", crows_cols)
+    #cs__.close()
+    if env_delta is not None and not DEBUG_DONOT_SEND:
+        yield [Mrunlib.ENV_TEMPLATE_END, env_delta.template_id]
+    stop_setup_time = time.perf_counter()
+    print("Setup ", (sent_env_count-1), " envs took ", (stop_setup_time - start_setup_time), " seconds")
+    return sent_env_count
+
+
+def load_cells(paths):
+    """load the grids and resolve the grid data of all cells (cached in path-to-cache-dir)
+    returns the cell table, its cache key and the crs of the soil grid"""
 
     #transforms geospatial coordinates from one coordinate reference system to another
     # transform wgs84 into gk5
     soil_crs_to_x_transformers = {}
     wgs84_crs = CRS.from_epsg(4326)
-    utm32_crs = CRS.from_epsg(25832)
     #transformers[wgs84] = Transformer.from_crs(wgs84_crs, gk5_crs, always_xy=True)
 
-    ilr_seed_harvest_data = defaultdict(lambda: {"interpolate": None, "data": defaultdict(dict), "is-winter-crop": None})
-
     # Load grids
 
     # soil data
     path_to_soil_grid = paths["path-to-data-dir"] + DATA_GRID_SOIL
     soil_epsg_code = int(path_to_soil_grid.split("/")[-1].split("_")[2])
     soil_crs = CRS.from_epsg(soil_epsg_code)
-    if wgs84_crs not in soil_crs_to_x_transformers:
-        soil_crs_to_x_transformers[wgs84_crs] = Transformer.from_crs(soil_crs, wgs84_crs)
     soil_metadata, _ = Mrunlib.read_header(path_to_soil_grid)
-    soil_grid = np.loadtxt(path_to_soil_grid, dtype=int, skiprows=6)
+    soil_grid = Mrunlib.load_ascii_grid(path_to_soil_grid, dtype=int)
     soil_interpolate = Mrunlib.create_ascii_grid_interpolator(soil_grid, soil_metadata)
     print("read: ", path_to_soil_grid)
 
@@ -149,7 +505,7 @@ def run_producer(server = {"server": None, "port": None}, shared_id = None):
     if dem_crs not in soil_crs_to_x_transformers:
         soil_crs_to_x_transformers[dem_crs] = Transformer.from_crs(soil_crs, dem_crs)
     dem_metadata, _ = Mrunlib.read_header(path_to_dem_grid)
-    dem_grid = np.loadtxt(path_to_dem_grid, dtype=float, skiprows=6)
+    dem_grid = Mrunlib.load_ascii_grid(path_to_dem_grid, dtype=float)
     dem_interpolate = Mrunlib.create_ascii_grid_interpolator(dem_grid, dem_metadata)
     print("read: ", path_to_dem_grid)
 
@@ -160,7 +516,7 @@ def run_producer(server = {"server": None, "port": None}, shared_id = None):
     if slope_crs not in soil_crs_to_x_transformers:
         soil_crs_to_x_transformers[slope_crs] = Transformer.from_crs(soil_crs, slope_crs)
     slope_metadata, _ = Mrunlib.read_header(path_to_slope_grid)
-    slope_grid = np.loadtxt(path_to_slope_grid, dtype=float, skiprows=6)
+    slope_grid = Mrunlib.load_ascii_grid(path_to_slope_grid, dtype=float)
     slope_interpolate = Mrunlib.create_ascii_grid_interpolator(slope_grid, slope_metadata)
     print("read: ", path_to_slope_grid)
 
@@ -168,11 +524,11 @@ def run_producer(server = {"server": None, "port": None}, shared_id = None):
     path_to_landuse_grid = paths["path-to-data-dir"] + DATA_GRID_LAND_USE
     landuse_epsg_code = int(path_to_landuse_grid.split("/")[-1].split("_")[2])
     landuse_crs = CRS.from_epsg(landuse_epsg_code)
-    if landuse_crs not in soil_crs_to_x_transformers:
-        soil_crs_to_x_transformers[landuse_crs] = Transformer.from_crs(soil_crs, landuse_crs)
-    landuse_meta, _ = Mrunlib.read_header(path_to_landuse_grid)
-    landuse_grid = np.loadtxt(path_to_landuse_grid, dtype=int, skiprows=6)
-    landuse_interpolate = Mrunlib.create_ascii_grid_interpolator(landuse_grid, landuse_meta)
+    # resampled once onto the soil grid, so the land use check is a boolean mask lookup without transformations
+    landuse_grid, landuse_meta = Mrunlib.load_or_create_aligned_ascii_grid(path_to_landuse_grid, landuse_crs,
+                                                                          path_to_soil_grid, soil_crs)
+    landcover_mask = np.isin(landuse_grid, [2,3,4])
+    landcover_interpolate = Mrunlib.create_ascii_grid_interpolator(landcover_mask, landuse_meta, ignore_nodata=False)
     print("read: ", path_to_landuse_grid)
 
     # crop mask data
@@ -182,439 +538,214 @@ def run_producer(server = {"server": None, "port": None}, shared_id = None):
     if crop_crs not in soil_crs_to_x_transformers:
         soil_crs_to_x_transformers[crop_crs] = Transformer.from_crs(soil_crs, crop_crs)
     crop_meta, _ = Mrunlib.read_header(path_to_crop_grid)
-    crop_grid = np.loadtxt(path_to_crop_grid, dtype=int, skiprows=6)
+    crop_grid = Mrunlib.load_ascii_grid(path_to_crop_grid, dtype=int)
     crop_interpolate = Mrunlib.create_ascii_grid_interpolator(crop_grid, crop_meta)
     print("read: ", path_to_crop_grid)
 
-    sent_env_count = 1
-    start_time = time.perf_counter()
-
-    listOfClimateFiles = set()
-    # run calculations for each setup
-    for _, setup_id in enumerate(run_setups):
+    srows = int(soil_metadata["nrows"])
+    scellsize = int(soil_metadata["cellsize"])
+    yllcorner = int(soil_metadata["yllcorner"])
+    nodata_value = int(soil_metadata["nodata_value"])
+
+    # the generator yields batches of cells as arrays, so the lookups are done per batch
+    def gen_100_files():
+        rowcol_to_latlon = {}
+        with open(paths["path-to-data-dir"] + "germany/dwd_core_ensemble_rowcol-to-latlon.json") as _:
+            for (row, col), (lat, lon) in json.load(_):
+                rowcol_to_latlon[(row, col)] = (lat, lon)
+
+        c_lats = []
+        c_lons = []
+        file_names = []
+        for root, _, files in os.walk(paths["path-to-100-climate-files"]):
+            for file in files:
+                if file.endswith(".csv"):
+                    ps = file[:-4].split("_")
+                    c_row_col = (int(ps[-2]), int(ps[-1]))
+                    if c_row_col in rowcol_to_latlon:
+                        c_lat, c_lon = rowcol_to_latlon[c_row_col]
+                    else:
+                        continue
+                    c_lats.append(c_lat)
+                    c_lons.append(c_lon)
+                    file_names.append(file)
 
-        if setup_id not in setups:
-            continue
-        start_setup_time = time.perf_counter()      
-
-        setup = setups[setup_id]
-        gcm = setup["gcm"]
-        rcm = setup["rcm"]
-        scenario = setup["scenario"]
-        ensmem = setup["ensmem"]
-        version = setup["version"]
-        crop_id = setup["crop-id"]
-
-        ## extract crop_id from crop-id name that has possible an extenstion
-        crop_id_short = crop_id.split('_')[0]
-
-        # add crop id from setup file
-        try:
-            #read seed/harvest dates for each crop_id
-            path_harvest = TEMPLATE_PATH_HARVEST.format(path_to_data_dir=paths["path-to-data-dir"],  crop_id=crop_id_short)
-            print("created seed harvest gk5 interpolator and read data: ", path_harvest)
-            Mrunlib.create_seed_harvest_geoGrid_interpolator_and_read_data(path_harvest, wgs84_crs, utm32_crs, ilr_seed_harvest_data)
-        except IOError:
-            path_harvest = TEMPLATE_PATH_HARVEST.format(path_to_data_dir=paths["path-to-data-dir"],  crop_id=crop_id_short)
-            print("Couldn't read file:", path_harvest)
-            continue
+        if file_names:
+            trans = Transformer.from_crs(wgs84_crs, soil_crs, always_xy=True)
+            srs, shs = trans.transform(np.array(c_lons), np.array(c_lats))
+            yield srs, shs, file_names
+
+    cell_batches = list(gen_100_files())
+    srs = np.concatenate([srs_ for srs_, _, _ in cell_batches] + [np.empty(0)])
+    shs = np.concatenate([shs_ for _, shs_, _ in cell_batches] + [np.empty(0)])
+    file_names = np.array([fn or "" for _, _, fns in cell_batches for fn in fns], dtype=str)
+
+    # everything which depends only on the grids is resolved once per cell and cached on disk
+    cells_key = {
+        "grids": [Mrunlib.file_key(p) for p in [path_to_soil_grid, path_to_dem_grid, path_to_slope_grid,
+                                                path_to_landuse_grid, path_to_crop_grid]],
+        "crs": [crs.to_string() for crs in [soil_crs, dem_crs, slope_crs, landuse_crs, crop_crs]],
+        "cells": Mrunlib.hash_arrays(srs, shs, file_names),
+        "columns": 2 # version of the columns of the cell table
+    }
 
-        cdict = {}
-        path = TEMPLATE_PATH_LATLON.format(path_to_climate_dir=paths["path-to-climate-dir"] + setup["climate_path_to_latlon_file"] + "/")
-        climate_data_interpolator = Mrunlib.create_climate_geoGrid_interpolator_from_json_file(path, wgs84_crs, soil_crs, cdict)
-        print("created climate_data to gk5 interpolator: ", path)
+    # all cell centres are transformed in one call per target crs and the coordinates are cached next to the cell table
+    cell_coords = {}
+    def get_cell_coords(crs):
+        if crs == soil_crs:
+            return srs, shs
+        if crs not in cell_coords:
+            def transform_cells():
+                xs, ys = soil_crs_to_x_transformers[crs].transform(srs, shs)
+                return {"x": xs, "y": ys}
+            coords = Mrunlib.load_or_create_cell_table(paths["path-to-cache-dir"], "coords", {
+                "from_crs": soil_crs.to_string(),
+                "to_crs": crs.to_string(),
+                "cells": cells_key["cells"]
+            }, transform_cells)
+            cell_coords[crs] = (coords["x"], coords["y"])
+        return cell_coords[crs]
+
+    def create_cell_table():
+        soil_ids = soil_interpolate(srs, shs)
+        is_valid = soil_ids != nodata_value
+        csrs = srs[is_valid]
+        cshs = shs[is_valid]
+        demrs, demhs = [cs[is_valid] for cs in get_cell_coords(dem_crs)]
+        slrs, slhs = [cs[is_valid] for cs in get_cell_coords(slope_crs)]
+        return {
+            "sr": csrs,
+            "sh": cshs,
+            # cells outside of the grid (nearest soil cell) count to the first/last row
+            "soil_row": np.clip(srows - 1 - np.floor((cshs - yllcorner) / scellsize).astype(int), 0, srows - 1),
+            "file_name": file_names[is_valid],
+            "soil_id": soil_ids[is_valid],
+            "crop_grid_id": crop_interpolate(csrs, cshs),
+            "is_landcover": landcover_interpolate(csrs, cshs),
+            "height": dem_interpolate(demrs, demhs),
+            "slope": slope_interpolate(slrs, slhs)
+        }
+
+    cells = Mrunlib.load_or_create_cell_table(paths["path-to-cache-dir"], "cells", cells_key, create_cell_table)
+    print("resolved grid data of ", len(cells["soil_id"]), " cells")
+
+    return cells, cells_key, soil_crs
 
-        # read template sim.json 
-        with open(setup.get("sim.json", config["sim.json"])) as _:
-            sim_json = json.load(_)
-        # change start and end date acording to setup
-        if setup["start_date"]:
-            sim_json["climate.csv-options"]["start-date"] = str(setup["start_date"])
-        if setup["end_date"]:
-            sim_json["climate.csv-options"]["end-date"] = str(setup["end_date"]) 
-        #sim_json["include-file-base-path"] = paths["include-file-base-path"]
-
-        # read template site.json
-        with open(setup.get("site.json", config["site.json"])) as _:
-            site_json = json.load(_)
-
-        if len(scenario) > 0 and scenario[:3].lower() == "rcp":
-            site_json["EnvironmentParameters"]["rcp"] = scenario
-
-        # read template crop.json
-        with open(setup.get("crop.json", config["crop.json"])) as _:
-            crop_json = json.load(_)
-
-        crop_json["CropParameters"]["__enable_vernalisation_factor_fix__"] = setup["use_vernalisation_fix"] if "use_vernalisation_fix" in setup else False
-
-        # set the current crop used for this run id
-        crop_json["cropRotation"][2] = crop_id
-
-        # create environment template from json templates
-        env_template = monica_io.create_env_json_from_json_config({
-            "crop": crop_json,
-            "site": site_json,
-            "sim": sim_json,
-            "climate": ""
-        })
-
-        scols = int(soil_metadata["ncols"])
-        srows = int(soil_metadata["nrows"])
-        scellsize = int(soil_metadata["cellsize"])
-        xllcorner = int(soil_metadata["xllcorner"])
-        yllcorner = int(soil_metadata["yllcorner"])
-        nodata_value = int(soil_metadata["nodata_value"])
-
-        def gen_all_row_cols():
-            for s_row in range(0, srows):
-                if s_row < int(config["start-row"]):
-                    continue
-                elif int(config["end-row"]) > 0 and s_row > int(config["end-row"]):
-                    break
-                for s_col in range(0, scols):
-                    sh = yllcorner + (scellsize / 2) + (srows - s_row - 1) * scellsize
-                    sr = xllcorner + (scellsize / 2) + s_col * scellsize
-                    yield sr, sh, None
-
-        def gen_100_files():
-            rowcol_to_latlon = {}
-            with open(paths["path-to-data-dir"] + "germany/dwd_core_ensemble_rowcol-to-latlon.json") as _:
-                for (row, col), (lat, lon) in json.load(_):
-                    rowcol_to_latlon[(row, col)] = (lat, lon)
 
-            trans = Transformer.from_crs(wgs84_crs, soil_crs, always_xy=True)
-            for root, _, files in os.walk(paths["path-to-100-climate-files"]):
-                for file in files:
-                    if file.endswith(".csv"):
-                        ps = file[:-4].split("_")
-                        c_row_col = (int(ps[-2]), int(ps[-1]))
-                        if c_row_col in rowcol_to_latlon:
-                            c_lat, c_lon = rowcol_to_latlon[c_row_col]
-                        else:
-                            continue
-                        sr, sh = trans.transform(c_lon, c_lat)
-                        yield sr, sh, file
-
-        soil_id_cache = {}
-        sent_env_count = 0
-        #for sr, sh, file_name in gen_all_row_cols():
-        for sr, sh, file_name in gen_100_files():
-
-            soil_id = int(soil_interpolate(sr, sh))
-            if soil_id == nodata_value:
-                continue
+# commandline parameters e.g "server=localhost port=6666 shared_id=2"
+def run_producer(server = {"server": None, "port": None}, shared_id = None):
+    context = zmq.Context()
+    socket = context.socket(zmq.PUSH)  # pylint: disable=no-member
 
-            #get coordinate of clostest climate element of real soil-cell
-            crow, ccol = climate_data_interpolator(sr, sh)
-
-            crop_grid_id = int(crop_interpolate(sr, sh))
-            # print(crop_grid_id)
-            if crop_grid_id != 1:
-                # print("row/col:", srow, "/", scol, "is not a crop pixel.")
-                env_template["customId"] = {
-                    "setup_id": setup_id,
-                    "crow": int(crow), "ccol": int(ccol),
-                    "soil_id": soil_id,
-                    "env_id": sent_env_count,
-                    "nodata": True
-                }
-                if not DEBUG_DONOT_SEND:
-                    socket.send_json(env_template)
-                    # print("sent nodata env ", sent_env_count, " customId: ", env_template["customId"])
-                    sent_env_count += 1
-                continue
+    config = {
+        "mode": "mp-local-remote", ## local:"cj-local-remote" remote "mbm-local-remote"
+        "server-port": server["port"] if server["port"] else "6666", ## local: 6667, remote 6666
+        "server": server["server"] if server["server"] else "localhost",  # "login01.cluster.zalf.de",
+        "start-row": "0", 
+        "end-row": "-1", 
+        "path_to_dem_grid": "",
+        "sim.json": "sim.json",
+        "crop.json": "crop.json",
+        "site.json": "site.json",
+        "setups-file": "sim_setups.csv",
+        "run-setups": "[1]",
+        "env-protocol": "full", # full: complete envs, delta: template + per cell deltas, expanded by run_env_expander.py
+        "setup-workers": "0", # processes preparing the setups ahead, 0 = prepare each setup when its envs are sent
+        "interleave-setups": "1", # number of setups whose envs are sent in turns
+        "compression": "", # codec (Mrunlib.CODECS) to compress the messages with, e.g. zlib or lzma, decompressed by run_codec_relay.py for the workers
+        "shared_id": shared_id
+    }
+    
+    # read commandline args only if script is invoked directly from commandline
+    if len(sys.argv) > 1 and __name__ == "__main__":
+        for arg in sys.argv[1:]:
+            k, v = arg.split("=")
+            if k in config:
+                config[k] = v
 
-            tcoords = {}
+    print("config:", config)
 
-            if soil_id in soil_id_cache:
-                soil_profile = soil_id_cache[soil_id]
-            else:
-                soil_profile = soil_io.soil_parameters(soil_db_con, soil_id)
-                soil_id_cache[soil_id] = soil_profile
-
-            if len(soil_profile) == 0:
-                env_template["customId"] = {
-                    "setup_id": setup_id,
-                    "crow": int(crow), "ccol": int(ccol),
-                    "soil_id": soil_id,
-                    "env_id": sent_env_count,
-                    "nodata": True
-                }
-                if not DEBUG_DONOT_SEND:
-                    socket.send_json(env_template)
-                    # print("sent nodata env ", sent_env_count, " customId: ", env_template["customId"])
-                    sent_env_count += 1
-                continue
+    def send_frames(frames):
+        "send a message, compressed if configured"
+        socket.send_multipart(Mrunlib.encode_frames(frames, config["compression"]), copy=False)
 
-            worksteps = env_template["cropRotation"][0]["worksteps"]
-            sowing_ws = next(filter(lambda ws: ws["type"][-6:] == "Sowing", worksteps))
-            harvest_ws = next(filter(lambda ws: ws["type"][-7:] == "Harvest", worksteps))
-
-            ilr_interpolate = ilr_seed_harvest_data[crop_id_short]["interpolate"]
-            seed_harvest_cs = int(ilr_interpolate(sr, sh)) if ilr_interpolate else None
-
-            # set external seed/harvest dates
-            if seed_harvest_cs:
-                seed_harvest_data = ilr_seed_harvest_data[crop_id_short]["data"][seed_harvest_cs]
-                if seed_harvest_data:
-                    is_winter_crop = ilr_seed_harvest_data[crop_id_short]["is-winter-crop"]
-
-                    if setup["sowing-date"] == "fixed":  # fixed indicates that regionally fixed sowing dates will be used
-                        sowing_date = seed_harvest_data["sowing-date"]
-                    elif setup["sowing-date"] == "auto":  # auto indicates that automatic sowng dates will be used that vary between regions
-                        sowing_date = seed_harvest_data["latest-sowing-date"]
-                    elif setup["sowing-date"] == "fixed1":  # fixed1 indicates that a fixed sowing date will be used that is the same for entire germany
-                        sowing_date = sowing_ws["date"]
-
-
-                    sds = [int(x) for x in sowing_date.split("-")]
-                    sd = date(2001, sds[1], sds[2])
-                    sdoy = sd.timetuple().tm_yday
-
-                    if setup["harvest-date"] == "fixed":  # fixed indicates that regionally fixed harvest dates will be used
-                        harvest_date = seed_harvest_data["harvest-date"]
-                    elif setup["harvest-date"] == "auto":  # auto indicates that automatic harvest dates will be used that vary between regions
-                        harvest_date = seed_harvest_data["latest-harvest-date"]
-                    elif setup["harvest-date"] == "auto1":  # fixed1 indicates that a fixed harvest date will be used that is the same for entire germany
-                        harvest_date = harvest_ws["latest-date"]
-
-                    # print("sowing_date:", sowing_date, "harvest_date:", harvest_date)
-                    # print("sowing_date:", sowing_ws["date"], "harvest_date:", sowing_ws["date"])
-
-                    hds = [int(x) for x in harvest_date.split("-")]
-                    hd = date(2001, hds[1], hds[2])
-                    hdoy = hd.timetuple().tm_yday
-
-                    esds = [int(x) for x in seed_harvest_data["earliest-sowing-date"].split("-")]
-                    esd = date(2001, esds[1], esds[2])
-
-                    # sowing after harvest should probably never occur in both fixed setup!
-                    if setup["sowing-date"] == "fixed" and setup["harvest-date"] == "fixed":
-                        #calc_harvest_date = date(2000, 12, 31) + timedelta(days=min(hdoy, sdoy-1))
-                        if is_winter_crop:
-                            calc_harvest_date = date(2000, 12, 31) + timedelta(days=min(hdoy, sdoy-1))
-                        else:
-                            calc_harvest_date = date(2000, 12, 31) + timedelta(days=hdoy)
-                        sowing_ws["date"] = seed_harvest_data["sowing-date"]
-                        harvest_ws["date"] = "{:04d}-{:02d}-{:02d}".format(hds[0], calc_harvest_date.month, calc_harvest_date.day)
-                        print("dates: ", int(seed_harvest_cs), ":", sowing_ws["date"])
-                        print("dates: ", int(seed_harvest_cs), ":", harvest_ws["date"])
-
-                    elif setup["sowing-date"] == "fixed" and setup["harvest-date"] == "auto":
-                        if is_winter_crop:
-                            calc_harvest_date = date(2000, 12, 31) + timedelta(days=min(hdoy, sdoy-1))
-                        else:
-                            calc_harvest_date = date(2000, 12, 31) + timedelta(days=hdoy)
-                        sowing_ws["date"] = seed_harvest_data["sowing-date"]
-                        harvest_ws["latest-date"] = "{:04d}-{:02d}-{:02d}".format(hds[0], calc_harvest_date.month, calc_harvest_date.day)
-                        print("dates: ", int(seed_harvest_cs), ":", sowing_ws["date"])
-                        print("dates: ", int(seed_harvest_cs), ":", harvest_ws["latest-date"])
-
-                    elif setup["sowing-date"] == "fixed" and setup["harvest-date"] == "auto1":
-                        if is_winter_crop:
-                            calc_harvest_date = date(2000, 12, 31) + timedelta(days=min(hdoy, sdoy - 1))
-                        else:
-                            calc_harvest_date = date(2000, 12, 31) + timedelta(days=hdoy)
-                        sowing_ws["date"] = seed_harvest_data["sowing-date"]
-                        harvest_ws["latest-date"] = "{:04d}-{:02d}-{:02d}".format(hds[0], hds[1], hds[2])
-                        print("dates: ", int(seed_harvest_cs), ":", sowing_ws["date"])
-                        print("dates: ", int(seed_harvest_cs), ":", harvest_ws["latest-date"])
-
-                    elif setup["sowing-date"] == "auto" and setup["harvest-date"] == "fixed":
-                        sowing_ws["earliest-date"] = seed_harvest_data["earliest-sowing-date"] if esd > date(esd.year, 6, 20) else "{:04d}-{:02d}-{:02d}".format(sds[0], 6, 20)
-                        calc_sowing_date = date(2000, 12, 31) + timedelta(days=max(hdoy+1, sdoy))
-                        sowing_ws["latest-date"] = "{:04d}-{:02d}-{:02d}".format(sds[0], calc_sowing_date.month, calc_sowing_date.day)
-                        harvest_ws["date"] = seed_harvest_data["harvest-date"]
-                        print("dates: ", int(seed_harvest_cs), ":", sowing_ws["earliest-date"], "<",
-                              sowing_ws["latest-date"])
-                        print("dates: ", int(seed_harvest_cs), ":", harvest_ws["date"])
-
-                    elif setup["sowing-date"] == "auto" and setup["harvest-date"] == "auto":
-                        sowing_ws["earliest-date"] = seed_harvest_data["earliest-sowing-date"] if esd > date(esd.year, 6, 20) else "{:04d}-{:02d}-{:02d}".format(sds[0], 6, 20)
-                        if is_winter_crop:
-                            calc_harvest_date = date(2000, 12, 31) + timedelta(days=min(hdoy, sdoy-1))
-                        else:
-                            calc_harvest_date = date(2000, 12, 31) + timedelta(days=hdoy)
-                        sowing_ws["latest-date"] = seed_harvest_data["latest-sowing-date"]
-                        harvest_ws["latest-date"] = "{:04d}-{:02d}-{:02d}".format(hds[0], calc_harvest_date.month, calc_harvest_date.day)
-                        print("dates: ", int(seed_harvest_cs), ":", sowing_ws["earliest-date"], "<",
-                              sowing_ws["latest-date"])
-                        print("dates: ", int(seed_harvest_cs), ":", harvest_ws["latest-date"])
-
-                    elif setup["sowing-date"] == "fixed1" and setup["harvest-date"] == "fixed":
-                        #calc_harvest_date = date(2000, 12, 31) + timedelta(days=min(hdoy, sdoy-1))
-                        if is_winter_crop:
-                            calc_harvest_date = date(2000, 12, 31) + timedelta(days=min(hdoy, sdoy-1))
-                        else:
-                            calc_harvest_date = date(2000, 12, 31) + timedelta(days=hdoy)
-                        sowing_ws["date"] = sowing_date
-                        # print(seed_harvest_data["sowing-date"])
-                        harvest_ws["date"] = "{:04d}-{:02d}-{:02d}".format(hds[0], calc_harvest_date.month, calc_harvest_date.day)
-                        print("dates: ", int(seed_harvest_cs), ":", sowing_ws["date"])
-                        print("dates: ", int(seed_harvest_cs), ":", harvest_ws["date"])
-
-
-
-
-            # check if current grid cell is used for agriculture
-            if setup["landcover"]:
-                if landuse_crs not in tcoords:
-                    tcoords[landuse_crs] = soil_crs_to_x_transformers[landuse_crs].transform(sr, sh)
-                lur, luh = tcoords[landuse_crs]
-                landuse_id = landuse_interpolate(lur, luh)
-                if landuse_id not in [2,3,4]:
-                    continue
-
-            if dem_crs not in tcoords:
-                tcoords[dem_crs] = soil_crs_to_x_transformers[dem_crs].transform(sr, sh)
-            demr, demh = tcoords[dem_crs]
-            height_nn = dem_interpolate(demr, demh)
-
-            if slope_crs not in tcoords:
-                tcoords[slope_crs] = soil_crs_to_x_transformers[slope_crs].transform(sr, sh)
-            slr, slh = tcoords[slope_crs]
-            slope = slope_interpolate(slr, slh)
-
-            env_template["params"]["userCropParameters"]["__enable_T_response_leaf_expansion__"] = setup["LeafExtensionModifier"]
-
-            #print("soil:", soil_profile)
-            env_template["params"]["siteParameters"]["SoilProfileParameters"] = soil_profile
-
-            # setting groundwater level
-            if setup["groundwater-level"]:
-                groundwaterlevel = 20
-                layer_depth = 0
-                for layer in soil_profile:
-                    if layer.get("is_in_groundwater", False):
-                        groundwaterlevel = layer_depth
-                        #print("setting groundwaterlevel of soil_id:", str(soil_id), "to", groundwaterlevel, "m")
-                        break
-                    layer_depth += Mrunlib.get_value(layer["Thickness"])
-                env_template["params"]["userEnvironmentParameters"]["MinGroundwaterDepthMonth"] = 3
-                env_template["params"]["userEnvironmentParameters"]["MinGroundwaterDepth"] = [max(0, groundwaterlevel - 0.2) , "m"]
-                env_template["params"]["userEnvironmentParameters"]["MaxGroundwaterDepth"] = [groundwaterlevel + 0.2, "m"]
-
-            # setting impenetrable layer
-            if setup["impenetrable-layer"]:
-                impenetrable_layer_depth = Mrunlib.get_value(env_template["params"]["userEnvironmentParameters"]["LeachingDepth"])
-                layer_depth = 0
-                for layer in soil_profile:
-                    if layer.get("is_impenetrable", False):
-                        impenetrable_layer_depth = layer_depth
-                        #print("setting leaching depth of soil_id:", str(soil_id), "to", impenetrable_layer_depth, "m")
-                        break
-                    layer_depth += Mrunlib.get_value(layer["Thickness"])
-                env_template["params"]["userEnvironmentParameters"]["LeachingDepth"] = [impenetrable_layer_depth, "m"]
-                env_template["params"]["siteParameters"]["ImpenetrableLayerDepth"] = [impenetrable_layer_depth, "m"]
-
-            if setup["elevation"]:
-                env_template["params"]["siteParameters"]["heightNN"] = float(height_nn)
-
-            if setup["slope"]:
-                env_template["params"]["siteParameters"]["slope"] = slope / 100.0
-
-            if setup["latitude"]:
-                clat, _ = cdict[(crow, ccol)]
-                env_template["params"]["siteParameters"]["Latitude"] = clat
-
-            if setup["CO2"]:
-                env_template["params"]["userEnvironmentParameters"]["AtmosphericCO2"] = float(setup["CO2"])
-
-            if setup["O3"]:
-                env_template["params"]["userEnvironmentParameters"]["AtmosphericO3"] = float(setup["O3"])
-
-            if setup["FieldConditionModifier"]:
-                env_template["cropRotation"][0]["worksteps"][0]["crop"]["cropParams"]["species"]["FieldConditionModifier"] = float(setup["FieldConditionModifier"])
-
-            if setup["StageTemperatureSum"]:
-                stage_ts = setup["StageTemperatureSum"].split('_')
-                stage_ts = [int(temp_sum) for temp_sum in stage_ts]
-                orig_stage_ts = env_template["cropRotation"][0]["worksteps"][0]["crop"]["cropParams"]["cultivar"][
-                    "StageTemperatureSum"][0]
-                if len(stage_ts) != len(orig_stage_ts):
-                    stage_ts = orig_stage_ts
-                    print('The provided StageTemperatureSum array is not '
-                          'sufficiently long. Falling back to original StageTemperatureSum')
-
-                env_template["cropRotation"][0]["worksteps"][0]["crop"]["cropParams"]["cultivar"][
-                    "StageTemperatureSum"][0] = stage_ts
-
-            env_template["params"]["simulationParameters"]["UseNMinMineralFertilisingMethod"] = setup["fertilization"]
-            env_template["params"]["simulationParameters"]["UseAutomaticIrrigation"] = setup["irrigation"]
-
-            env_template["params"]["simulationParameters"]["NitrogenResponseOn"] = setup["NitrogenResponseOn"]
-            env_template["params"]["simulationParameters"]["WaterDeficitResponseOn"] = setup["WaterDeficitResponseOn"]
-            env_template["params"]["simulationParameters"]["EmergenceMoistureControlOn"] = setup["EmergenceMoistureControlOn"]
-            env_template["params"]["simulationParameters"]["EmergenceFloodingControlOn"] = setup["EmergenceFloodingControlOn"]
-
-            env_template["csvViaHeaderOptions"] = sim_json["climate.csv-options"]
-
-            if file_name:
-                env_template["pathToClimateCSV"] = paths["path-to-100-climate-files"] + "/" + file_name
-            else:
-                subpath_to_csv = TEMPLATE_PATH_CLIMATE_CSV.format(gcm=gcm, rcm=rcm, scenario=scenario, ensmem=ensmem, version=version, crow=str(crow), ccol=str(ccol))
-                for _ in range(4):
-                    subpath_to_csv = subpath_to_csv.replace("//", "/")
-                env_template["pathToClimateCSV"] = [paths["monica-path-to-climate-dir"] + setup["climate_path_to_csvs"] + "/" + subpath_to_csv]
-                if setup["incl_hist"]:
-
-                    if rcm[:3] == "UHO":
-                        hist_subpath_to_csv = TEMPLATE_PATH_CLIMATE_CSV.format(gcm=gcm, rcm="CLMcom-CCLM4-8-17", scenario="historical", ensmem=ensmem, version=version, crow=str(crow), ccol=str(ccol))
-                        for _ in range(4):
-                            hist_subpath_to_csv = hist_subpath_to_csv.replace("//", "/")
-                        env_template["pathToClimateCSV"].insert(0, paths["monica-path-to-climate-dir"] + setup["climate_path_to_csvs"] + "/" + hist_subpath_to_csv)
-
-                    elif rcm[:3] == "SMH":
-                        hist_subpath_to_csv = TEMPLATE_PATH_CLIMATE_CSV.format(gcm=gcm, rcm="CLMcom-CCLM4-8-17", scenario="historical", ensmem=ensmem, version=version, crow=str(crow), ccol=str(ccol))
-                        for _ in range(4):
-                            hist_subpath_to_csv = hist_subpath_to_csv.replace("//", "/")
-                        env_template["pathToClimateCSV"].insert(0, paths["monica-path-to-climate-dir"] + setup["climate_path_to_csvs"] + "/" + hist_subpath_to_csv)
-
-                    hist_subpath_to_csv = TEMPLATE_PATH_CLIMATE_CSV.format(gcm=gcm, rcm=rcm, scenario="historical", ensmem=ensmem, version=version, crow=str(crow), ccol=str(ccol))
-                    for _ in range(4):
-                        hist_subpath_to_csv = hist_subpath_to_csv.replace("//", "/")
-                    env_template["pathToClimateCSV"].insert(0, paths["monica-path-to-climate-dir"] + setup["climate_path_to_csvs"] + "/" + hist_subpath_to_csv)
-            print("pathToClimateCSV:", env_template["pathToClimateCSV"])
+    # select paths 
+    paths = PATHS[config["mode"]]
+    # open soil db connection
+    soil_db_con = soil_io.open_soil_db(paths["path-to-data-dir"] + DATA_SOIL_DB)
+    socket.connect("tcp://" + config["server"] + ":" + str(config["server-port"]))
 
-            env_template["customId"] = {
-                "setup_id": setup_id,
-                "crow": int(crow), "ccol": int(ccol),
-                "soil_id": soil_id,
-                "env_id": sent_env_count,
-                "nodata": False
-            }
+    # read setup from csv file
+    setups = Mrunlib.read_sim_setups(config["setups-file"])
+    run_setups = json.loads(config["run-setups"])
+    print("read sim setups: ", config["setups-file"])
 
-            if not DEBUG_DONOT_SEND :
-                socket.send_json(env_template)
-                print("sent env ", sent_env_count, " customId: ", env_template["customId"])
+    # crop id -> ILR station store, read once per crop
+    ilr_seed_harvest_data = {}
 
-            sent_env_count += 1
+    cells, cells_key, soil_crs = load_cells(paths)
 
-            # write debug output, as json file
-            if DEBUG_WRITE:
-                debug_write_folder = paths["path-debug-write-folder"]
-                if not os.path.exists(debug_write_folder):
-                    os.makedirs(debug_write_folder)
-                if sent_env_count < DEBUG_ROWS:
+    # only the cells in the soil grid rows start-row to end-row (e.g. a band of run_producer_coordinator.py),
+    # end-row -1 = up to the last row
+    start_row = int(config["start-row"])
+    end_row = int(config["end-row"])
+    if start_row > 0 or end_row >= 0:
+        in_rows = (cells["soil_row"] >= start_row) & ((cells["soil_row"] <= end_row) if end_row >= 0 else True)
+        cells = {col: values[in_rows] for col, values in cells.items()}
+        # the setup cell tables are derived from the cells of these rows only
+        cells_key = dict(cells_key, rows=[start_row, end_row])
+        print("using ", len(cells["soil_id"]), " cells of rows ", start_row, " to ", end_row)
 
-                    path_to_debug_file = f"{debug_write_folder}/sid-{setup_id}_crow-{crow}_ccol-{ccol}.json"
+    # the soil profiles of all cells, loaded once for all setups
+    soil_io.preload_soil_parameters(soil_db_con, np.unique(cells["soil_id"]).tolist())
+    print("loaded soil profiles")
 
-                    if not os.path.isfile(path_to_debug_file):
-                        with open(path_to_debug_file, "w") as _ :
-                            _.write(json.dumps(env_template))
-                    else:
-                        print("WARNING: Row ", (sent_env_count-1), " already exists")
-            #print("unknown_soil_ids:", unknown_soil_ids)
+    start_time = time.perf_counter()
 
-            #print("crows/cols:", crows_cols)
-        #cs__.close()
-        stop_setup_time = time.perf_counter()
-        print("Setup ", (sent_env_count-1), " envs took ", (stop_setup_time - start_setup_time), " seconds")
+    # the setups are prepared one after another before their envs are sent or ahead by a pool of setup-workers processes,
+    # the envs of up to interleave-setups prepared setups are sent in turns, so the workers don't run dry between setups
+    run_setup_ids = [setup_id for setup_id in run_setups if setup_id in setups]
+    max_env_streams = max(1, int(config["interleave-setups"]))
+    prepared_setups = [None] * len(run_setup_ids)
+    pool = None
+    if int(config["setup-workers"]) > 0:
+        pool = ProcessPoolExecutor(int(config["setup-workers"]), initializer=init_setup_worker,
+                                   initargs=(config, paths, cells, cells_key, soil_crs))
+        prepared_setups = [pool.submit(prepare_setup_in_worker, setup_id, setups[setup_id]) for setup_id in run_setup_ids]
+
+    sent_env_count = 0
+    env_streams = []
+    next_setup = 0
+    while env_streams or next_setup < len(run_setup_ids):
+        # start the env streams of the next setups, waiting for a preparation only if no envs are sent meanwhile
+        while next_setup < len(run_setup_ids) and len(env_streams) < max_env_streams \
+                and (not env_streams or pool is None or prepared_setups[next_setup].done()):
+            setup_id = run_setup_ids[next_setup]
+            start_setup_time = time.perf_counter()
+            if pool:
+                prepared = prepared_setups[next_setup].result()
+            else:
+                prepared = prepare_setup(setup_id, setups[setup_id], config, paths, cells, cells_key, soil_crs,
+                                         ilr_seed_harvest_data)
+            next_setup += 1
+            if prepared:
+                env_streams.append(gen_setup_env_frames(setup_id, setups[setup_id], prepared, cells, soil_db_con,
+                                                        config, paths, start_setup_time))
+
+        for env_stream in list(env_streams):
+            try:
+                send_frames(next(env_stream))
+            except StopIteration as stop:
+                sent_env_count += stop.value
+                env_streams.remove(env_stream)
+
+    if pool:
+        pool.shutdown()
 
     stop_time = time.perf_counter()
 
     try:
-        print("sending ", (sent_env_count-1), " envs took ", (stop_time - start_time), " seconds")
+        print("sending ", sent_env_count, " envs took ", (stop_time - start_time), " seconds")
         #print("ran from ", start, "/", row_cols[start], " to ", end, "/", row_cols[end]
         print("exiting run_producer()")
     except Exception:
@@ -0,0 +1,94 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+# runs several run_producer.py processes, each for a band of rows of the soil grid (start-row/end-row),
+# the bands have about the same number of cells of the producers' cell table,
+# all producers connect to the same server (their PUSH sockets are fair queued by the receiving side)
+# commandline parameters e.g "producers=4 log-dir=./producer-logs server=localhost run-setups=[1,2]"
+# all parameters except producers and log-dir are passed on to the producers
+
+import numpy as np
+import os
+import re
+import subprocess
+import sys
+import time
+
+import monica_run_lib as Mrunlib
+import run_producer
+
+
+def run_producer_coordinator():
+    config = {
+        "producers": str(os.cpu_count() or 1),
+        "log-dir": "./producer-logs/", # stdout/stderr of the producers
+        "mode": "mp-local-remote" # the paths of run_producer.py to load the cell table
+    }
+    producer_args = []
+
+    if len(sys.argv) > 1 and __name__ == "__main__":
+        for arg in sys.argv[1:]:
+            k, v = arg.split("=")
+            if k in config:
+                config[k] = v
+            if k not in ["producers", "log-dir"]:
+                producer_args.append(arg)
+
+    print("config:", config, "producer args:", producer_args)
+
+    # the cells per soil grid row of the cell table the producers run (loaded from or stored in the cache for them)
+    cells, _, _ = run_producer.load_cells(run_producer.PATHS[config["mode"]])
+    cells_per_row = np.bincount(cells["soil_row"], minlength=1)
+    bands = Mrunlib.balanced_row_bands(cells_per_row, int(config["producers"]))
+    print("cells per band:", [int(cells_per_row[start:end + 1].sum()) for start, end in bands])
+
+    os.makedirs(config["log-dir"], exist_ok=True)
+    path_to_producer = os.path.join(os.path.dirname(os.path.abspath(__file__)), "run_producer.py")
+    start_time = time.perf_counter()
+    producers = []
+    for i, (start_row, end_row) in enumerate(bands):
+        path_to_log = os.path.join(config["log-dir"], "producer-{}_rows-{}-{}.log".format(i, start_row, end_row))
+        log_file = open(path_to_log, "w")
+        process = subprocess.Popen([sys.executable, path_to_producer, "start-row=" + str(start_row), "end-row=" + str(end_row)]
+                                   + producer_args, stdout=log_file, stderr=subprocess.STDOUT)
+        producers.append((process, log_file, path_to_log, start_row, end_row))
+        print("started producer", i, "for rows", start_row, "to", end_row, "log:", path_to_log)
+
+    # the producers print "sending <n> envs took <s> seconds" at the end
+    total_env_count = 0
+    for i, (process, log_file, path_to_log, start_row, end_row) in enumerate(producers):
+        exit_code = process.wait()
+        log_file.close()
+        env_count = 0
+        seconds = None
+        with open(path_to_log) as _:
+            for line in _:
+                match = re.match(r"sending\s+(\d+)\s+envs took\s+([\d.e+-]+)\s+seconds", line)
+                if match:
+                    env_count = int(match.group(1))
+                    seconds = float(match.group(2))
+        total_env_count += env_count
+        print("producer", i, "rows", start_row, "to", end_row, "exit code:", exit_code, "envs:", env_count,
+              "envs/s:", round(env_count / seconds, 1) if seconds else "-")
+
+    took = time.perf_counter() - start_time
+    print("sent", total_env_count, "envs with", len(producers), "producers in", round(took, 2), "seconds,",
+          round(total_env_count / took, 1), "envs/s")
+
+
+if __name__ == "__main__":
+    run_producer_coordinator()
@@ -19,8 +19,6 @@ import asyncio
 import itertools
 
 import capnp
-from collections import defaultdict
-from datetime import date, timedelta
 import json
 import os
 from pathlib import Path
@@ -98,8 +96,8 @@ async def run_producer(server=None, port=None):
     utm32_crs = CRS.from_epsg(25832)
     wgs84_to_utm32_trans = Transformer.from_crs(wgs84_crs, utm32_crs, always_xy=True)
 
-    ilr_seed_harvest_data = defaultdict(lambda: {"interpolate": None, "data": defaultdict(dict),
-                                                 "is-winter-crop": None})
+    # crop id -> ILR station store, read once per crop
+    ilr_seed_harvest_data = {}
 
     conman = common.ConnectionManager()
     soil_service = await conman.try_connect("capnp://localhost:9901/soil", cast_as=soil_capnp.Service, retry_secs=1)
@@ -131,8 +129,9 @@ async def run_producer(server=None, port=None):
         try:
             #read seed/harvest dates for each crop_id
             path_harvest = TEMPLATE_PATH_HARVEST.format(path_to_data_dir=paths["path-to-data-dir"],  crop_id=crop_id_short)
-            print("created seed harvest gk5 interpolator and read data: ", path_harvest)
-            Mrunlib.create_seed_harvest_geoGrid_interpolator_and_read_data(path_harvest, wgs84_crs, utm32_crs, ilr_seed_harvest_data)
+            if crop_id_short not in ilr_seed_harvest_data:
+                print("created seed harvest gk5 interpolator and read data: ", path_harvest)
+                Mrunlib.create_seed_harvest_geoGrid_interpolator_and_read_data(path_harvest, wgs84_crs, utm32_crs, ilr_seed_harvest_data)
         except IOError:
             path_harvest = TEMPLATE_PATH_HARVEST.format(path_to_data_dir=paths["path-to-data-dir"],  crop_id=crop_id_short)
             print("Couldn't read file:", path_harvest)
@@ -177,6 +176,17 @@ async def run_producer(server=None, port=None):
             "climate": ""
         })
 
+        worksteps = env_template["cropRotation"][0]["worksteps"]
+        sowing_ws = next(filter(lambda ws: ws["type"][-6:] == "Sowing", worksteps))
+        harvest_ws = next(filter(lambda ws: ws["type"][-7:] == "Harvest", worksteps))
+
+        # external sowing/harvest dates of this setup per ILR station
+        seed_harvest_worksteps = {}
+        if crop_id_short in ilr_seed_harvest_data:
+            seed_harvest_worksteps = Mrunlib.create_seed_harvest_worksteps(ilr_seed_harvest_data[crop_id_short],
+                                                                           setup["sowing-date"], setup["harvest-date"],
+                                                                           sowing_ws, harvest_ws)
+
         #def gen_all_row_cols():
         #    for s_row in range(0, srows):
         #        if s_row < int(config["start-row"]):
@@ -236,113 +246,15 @@ async def run_producer(server=None, port=None):
             #else:
             #    env_template["params"]["siteParameters"]["SoilProfileParameters"] = soil_profiles_.profiles[0]
 
-            worksteps = env_template["cropRotation"][0]["worksteps"]
-            sowing_ws = next(filter(lambda ws: ws["type"][-6:] == "Sowing", worksteps))
-            harvest_ws = next(filter(lambda ws: ws["type"][-7:] == "Harvest", worksteps))
-
             sr, sh = wgs84_to_utm32_trans.transform(c_lon, c_lat)
-            ilr_interpolate = ilr_seed_harvest_data[crop_id_short]["interpolate"]
+            ilr_interpolate = ilr_seed_harvest_data.get(crop_id_short, {}).get("interpolate")
             seed_harvest_cs = int(ilr_interpolate(sr, sh)) if ilr_interpolate else None
 
             # set external seed/harvest dates
-            if seed_harvest_cs:
-                seed_harvest_data = ilr_seed_harvest_data[crop_id_short]["data"][seed_harvest_cs]
-                if seed_harvest_data:
-                    is_winter_crop = ilr_seed_harvest_data[crop_id_short]["is-winter-crop"]
-
-                    if setup["sowing-date"] == "fixed":  # fixed indicates that regionally fixed sowing dates will be used
-                        sowing_date = seed_harvest_data["sowing-date"]
-                    elif setup["sowing-date"] == "auto":  # auto indicates that automatic sowng dates will be used that vary between regions
-                        sowing_date = seed_harvest_data["latest-sowing-date"]
-                    elif setup["sowing-date"] == "fixed1":  # fixed1 indicates that a fixed sowing date will be used that is the same for entire germany
-                        sowing_date = sowing_ws["date"]
-
-
-                    sds = [int(x) for x in sowing_date.split("-")]
-                    sd = date(2001, sds[1], sds[2])
-                    sdoy = sd.timetuple().tm_yday
-
-                    if setup["harvest-date"] == "fixed":  # fixed indicates that regionally fixed harvest dates will be used
-                        harvest_date = seed_harvest_data["harvest-date"]
-                    elif setup["harvest-date"] == "auto":  # auto indicates that automatic harvest dates will be used that vary between regions
-                        harvest_date = seed_harvest_data["latest-harvest-date"]
-                    elif setup["harvest-date"] == "auto1":  # fixed1 indicates that a fixed harvest date will be used that is the same for entire germany
-                        harvest_date = harvest_ws["latest-date"]
-
-                    # print("sowing_date:", sowing_date, "harvest_date:", harvest_date)
-                    # print("sowing_date:", sowing_ws["date"], "harvest_date:", sowing_ws["date"])
-
-                    hds = [int(x) for x in harvest_date.split("-")]
-                    hd = date(2001, hds[1], hds[2])
-                    hdoy = hd.timetuple().tm_yday
-
-                    esds = [int(x) for x in seed_harvest_data["earliest-sowing-date"].split("-")]
-                    esd = date(2001, esds[1], esds[2])
-
-                    # sowing after harvest should probably never occur in both fixed setup!
-                    if setup["sowing-date"] == "fixed" and setup["harvest-date"] == "fixed":
-                        #calc_harvest_date = date(2000, 12, 31) + timedelta(days=min(hdoy, sdoy-1))
-                        if is_winter_crop:
-                            calc_harvest_date = date(2000, 12, 31) + timedelta(days=min(hdoy, sdoy-1))
-                        else:
-                            calc_harvest_date = date(2000, 12, 31) + timedelta(days=hdoy)
-                        sowing_ws["date"] = seed_harvest_data["sowing-date"]
-                        harvest_ws["date"] = "{:04d}-{:02d}-{:02d}".format(hds[0], calc_harvest_date.month, calc_harvest_date.day)
-                        print("dates: ", int(seed_harvest_cs), ":", sowing_ws["date"])
-                        print("dates: ", int(seed_harvest_cs), ":", harvest_ws["date"])
-
-                    elif setup["sowing-date"] == "fixed" and setup["harvest-date"] == "auto":
-                        if is_winter_crop:
-                            calc_harvest_date = date(2000, 12, 31) + timedelta(days=min(hdoy, sdoy-1))
-                        else:
-                            calc_harvest_date = date(2000, 12, 31) + timedelta(days=hdoy)
-                        sowing_ws["date"] = seed_harvest_data["sowing-date"]
-                        harvest_ws["latest-date"] = "{:04d}-{:02d}-{:02d}".format(hds[0], calc_harvest_date.month, calc_harvest_date.day)
-                        print("dates: ", int(seed_harvest_cs), ":", sowing_ws["date"])
-                        print("dates: ", int(seed_harvest_cs), ":", harvest_ws["latest-date"])
-
-                    elif setup["sowing-date"] == "fixed" and setup["harvest-date"] == "auto1":
-                        if is_winter_crop:
-                            calc_harvest_date = date(2000, 12, 31) + timedelta(days=min(hdoy, sdoy - 1))
-                        else:
-                            calc_harvest_date = date(2000, 12, 31) + timedelta(days=hdoy)
-                        sowing_ws["date"] = seed_harvest_data["sowing-date"]
-                        harvest_ws["latest-date"] = "{:04d}-{:02d}-{:02d}".format(hds[0], hds[1], hds[2])
-                        print("dates: ", int(seed_harvest_cs), ":", sowing_ws["date"])
-                        print("dates: ", int(seed_harvest_cs), ":", harvest_ws["latest-date"])
-
-                    elif setup["sowing-date"] == "auto" and setup["harvest-date"] == "fixed":
-                        sowing_ws["earliest-date"] = seed_harvest_data["earliest-sowing-date"] if esd > date(esd.year, 6, 20) else "{:04d}-{:02d}-{:02d}".format(sds[0], 6, 20)
-                        calc_sowing_date = date(2000, 12, 31) + timedelta(days=max(hdoy+1, sdoy))
-                        sowing_ws["latest-date"] = "{:04d}-{:02d}-{:02d}".format(sds[0], calc_sowing_date.month, calc_sowing_date.day)
-                        harvest_ws["date"] = seed_harvest_data["harvest-date"]
-                        print("dates: ", int(seed_harvest_cs), ":", sowing_ws["earliest-date"], "<",
-                              sowing_ws["latest-date"])
-                        print("dates: ", int(seed_harvest_cs), ":", harvest_ws["date"])
-
-                    elif setup["sowing-date"] == "auto" and setup["harvest-date"] == "auto":
-                        sowing_ws["earliest-date"] = seed_harvest_data["earliest-sowing-date"] if esd > date(esd.year, 6, 20) else "{:04d}-{:02d}-{:02d}".format(sds[0], 6, 20)
-                        if is_winter_crop:
-                            calc_harvest_date = date(2000, 12, 31) + timedelta(days=min(hdoy, sdoy-1))
-                        else:
-                            calc_harvest_date = date(2000, 12, 31) + timedelta(days=hdoy)
-                        sowing_ws["latest-date"] = seed_harvest_data["latest-sowing-date"]
-                        harvest_ws["latest-date"] = "{:04d}-{:02d}-{:02d}".format(hds[0], calc_harvest_date.month, calc_harvest_date.day)
-                        print("dates: ", int(seed_harvest_cs), ":", sowing_ws["earliest-date"], "<",
-                              sowing_ws["latest-date"])
-                        print("dates: ", int(seed_harvest_cs), ":", harvest_ws["latest-date"])
-
-                    elif setup["sowing-date"] == "fixed1" and setup["harvest-date"] == "fixed":
-                        #calc_harvest_date = date(2000, 12, 31) + timedelta(days=min(hdoy, sdoy-1))
-                        if is_winter_crop:
-                            calc_harvest_date = date(2000, 12, 31) + timedelta(days=min(hdoy, sdoy-1))
-                        else:
-                            calc_harvest_date = date(2000, 12, 31) + timedelta(days=hdoy)
-                        sowing_ws["date"] = sowing_date
-                        # print(seed_harvest_data["sowing-date"])
-                        harvest_ws["date"] = "{:04d}-{:02d}-{:02d}".format(hds[0], calc_harvest_date.month, calc_harvest_date.day)
-                        print("dates: ", int(seed_harvest_cs), ":", sowing_ws["date"])
-                        print("dates: ", int(seed_harvest_cs), ":", harvest_ws["date"])
+            if seed_harvest_cs in seed_harvest_worksteps:
+                sowing_values, harvest_values = seed_harvest_worksteps[seed_harvest_cs]
+                sowing_ws.update(sowing_values)
+                harvest_ws.update(harvest_values)
 
             env_template["params"]["userCropParameters"]["__enable_T_response_leaf_expansion__"] = setup["LeafExtensionModifier"]
 
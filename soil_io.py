@@ -12,16 +12,28 @@
 # Landscape Systems Analysis at the ZALF.
 # Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
 
+import contextlib
+import json
+import numpy as np
+import os
 import sqlite3
+import threading
+import urllib.parse
 
 #------------------------------------------------------------------------------
 
 def soil_parameters(con, profile_id):
     "compatibility function to get soil parameters for older monica python scripts"
+    return check_layers(get_soil_profile(con, profile_id)[0][1])
+
+#------------------------------------------------------------------------------
+
+def check_layers(profile_layers):
+    "return only the complete layers of a profile, the thickness of incomplete layers is added to their neighbours"
 
     layers = []
     skipped_depths = 0
-    for layer in get_soil_profile(con, profile_id)[0][1]:
+    for layer in profile_layers:
         found = lambda key: key in layer
         layer_is_ok = found("Thickness") \
             and (found("SoilOrganicCarbon") \
@@ -50,6 +62,203 @@ def soil_parameters(con, profile_id):
 
 #------------------------------------------------------------------------------
 
+# table -> (index name, columns) the profile queries are ordered by
+SOIL_DB_INDEXES = {
+    "soil_profile": ("soil_profile_id_layer_depth_idx", ["id", "layer_depth"]),
+    "soil_profile_all": ("soil_profile_all_polygon_id_profile_id_layer_depth_idx",
+                         ["polygon_id", "profile_id_in_polygon", "layer_depth"])
+}
+
+
+def missing_soil_db_indexes(con):
+    "return [(table, index name, columns)] of the SOIL_DB_INDEXES which don't exist (as prefix of any index) in the db"
+    tables = set(row[0] for row in con.execute("select name from sqlite_master where type = 'table'"))
+    missing = []
+    for table, (index_name, index_cols) in SOIL_DB_INDEXES.items():
+        if table not in tables:
+            continue
+        has_index = False
+        for index_row in con.execute("pragma index_list({})".format(table)):
+            cols = [info_row[2] for info_row in con.execute("pragma index_info({})".format(index_row[1]))]
+            if cols[:len(index_cols)] == index_cols:
+                has_index = True
+                break
+        if not has_index:
+            missing.append((table, index_name, index_cols))
+    return missing
+
+
+def create_soil_db_indexes(path_to_soil_db):
+    "create the missing SOIL_DB_INDEXES in the soil db (opened writable)"
+    con = sqlite3.connect(path_to_soil_db)
+    try:
+        for table, index_name, index_cols in missing_soil_db_indexes(con):
+            print("creating index", index_name, "on", table, index_cols)
+            con.execute("create index if not exists {} on {}({})".format(index_name, table, ", ".join(index_cols)))
+        con.commit()
+    finally:
+        con.close()
+
+
+def open_soil_db(path_to_soil_db, immutable=False, mmap_size=256*1024*1024, cache_size_kib=64*1024,
+                 create_indexes=False, check_same_thread=True):
+    """open a soil db read only (uri mode=ro, immutable=1 if the file won't change while it is open)
+    with a memory mapped io size and page cache size (in KiB) for the connection
+    missing indexes for the ordered profile queries are reported or created if create_indexes"""
+
+    if create_indexes:
+        create_soil_db_indexes(path_to_soil_db)
+
+    uri = "file:{}?mode=ro{}".format(urllib.parse.quote(os.path.abspath(path_to_soil_db)), "&immutable=1" if immutable else "")
+    con = sqlite3.connect(uri, uri=True, check_same_thread=check_same_thread)
+    con.execute("pragma mmap_size = {}".format(int(mmap_size)))
+    con.execute("pragma cache_size = {}".format(-int(cache_size_kib)))
+    con.row_factory = sqlite3.Row
+
+    for table, index_name, index_cols in missing_soil_db_indexes(con):
+        print("soil db", path_to_soil_db, "has no index on", table, index_cols, "(use create_indexes=True to create it)")
+
+    return con
+
+
+def create_soil_db_pool(path_to_soil_db, max_connections=4, **open_args):
+    """create a thread safe pool of read only connections (see open_soil_db) to a soil db
+    usage: pool = create_soil_db_pool(path); with pool() as con: ...; pool.close()
+    at most max_connections are opened, further users wait for a free connection,
+    after pool.close() (pool.closed) using the pool raises a RuntimeError"""
+
+    free_connections = []
+    condition = threading.Condition()
+    open_count = [0]
+
+    @contextlib.contextmanager
+    def connection():
+        with condition:
+            while True:
+                if connection.closed:
+                    raise RuntimeError("soil db pool of {} is closed".format(path_to_soil_db))
+                if free_connections:
+                    con = free_connections.pop()
+                    break
+                if open_count[0] < max_connections:
+                    con = open_soil_db(path_to_soil_db, check_same_thread=False, **open_args)
+                    open_count[0] += 1
+                    break
+                condition.wait()
+        try:
+            yield con
+        finally:
+            with condition:
+                # connections in use while the pool was closed are closed when they are given back
+                if connection.closed:
+                    con.close()
+                else:
+                    free_connections.append(con)
+                    condition.notify()
+
+    def close():
+        with condition:
+            connection.closed = True
+            while free_connections:
+                free_connections.pop().close()
+            condition.notify_all()
+
+    connection.closed = False
+    connection.close = close
+    return connection
+
+#------------------------------------------------------------------------------
+
+# (database file, profile id) -> checked layers, kept for the lifetime of the process
+soil_parameters_cache = {}
+
+
+# id(connection) -> (connection, file of its main database), the connection is kept so its id isn't reused
+database_files = {}
+
+
+def database_file(con):
+    "return the file of the main database of the connection, queried once per connection"
+    con_and_file = database_files.get(id(con))
+    if con_and_file is None:
+        for row in con.execute("pragma database_list"):
+            if row[1] == "main":
+                con_and_file = database_files[id(con)] = (con, row[2])
+                break
+        else:
+            return None
+    return con_and_file[1]
+
+
+def preload_soil_parameters(con, profile_ids):
+    """load the soil parameters of all given profile ids (e.g. all ids of the soil grid) in a single
+    ordered scan of the soil_profile table (derived column wise), the results are kept in soil_parameters_cache"""
+
+    db_file = database_file(con)
+    missing_ids = set(int(profile_id) for profile_id in profile_ids) \
+        - set(profile_id for db, profile_id in soil_parameters_cache.keys() if db == db_file)
+    if len(missing_ids) == 0:
+        return
+
+    columns = read_soil_profile_columns(con)
+    is_missing = np.isin(columns["id"], np.array(list(missing_ids), dtype=np.int64))
+    columns = {col: arr[is_missing] for col, arr in columns.items()}
+    profile_layers = {}
+    for profile_id, layer in zip(columns["id"].tolist(), create_layers_from_columns(columns)):
+        profile_layers.setdefault(profile_id, []).append(layer)
+    for profile_id, layers in profile_layers.items():
+        soil_parameters_cache[(db_file, profile_id)] = check_layers(layers)
+        missing_ids.discard(profile_id)
+
+    # profile ids without layers
+    for profile_id in missing_ids:
+        soil_parameters_cache[(db_file, profile_id)] = []
+
+
+def cached_soil_parameters(con, profile_id):
+    "soil_parameters for profile_id from the soil_parameters_cache, profiles which haven't been preloaded are loaded and cached"
+
+    key = (database_file(con), int(profile_id))
+    if key not in soil_parameters_cache:
+        soil_parameters_cache[key] = soil_parameters(con, profile_id)
+    return soil_parameters_cache[key]
+
+
+# (database file, profile id) -> site values derived from the checked layers
+soil_site_fragment_cache = {}
+
+
+def depth_of_first_layer(layers, flag):
+    "depth [m] of the upper boundary of the first layer with flag set, None if no layer has it"
+    layer_depth = 0
+    for layer in layers:
+        if layer.get(flag, False):
+            return layer_depth
+        thickness = layer["Thickness"]
+        layer_depth += thickness[0] if isinstance(thickness, list) else thickness
+    return None
+
+
+def soil_site_fragment(layers):
+    """the parts of a site which depend only on the soil profile:
+    groundwater depth, impenetrable layer depth (None if there is none) and the profile serialized to json (utf8 bytes)"""
+    return {
+        "groundwater-depth": depth_of_first_layer(layers, "is_in_groundwater"),
+        "impenetrable-layer-depth": depth_of_first_layer(layers, "is_impenetrable"),
+        "profile-json": json.dumps(layers).encode("utf8")
+    }
+
+
+def cached_soil_site_fragment(con, profile_id):
+    "soil_site_fragment of the (cached) soil_parameters of profile_id, computed once per profile"
+
+    key = (database_file(con), int(profile_id))
+    if key not in soil_site_fragment_cache:
+        soil_site_fragment_cache[key] = soil_site_fragment(cached_soil_parameters(con, profile_id))
+    return soil_site_fragment_cache[key]
+
+#------------------------------------------------------------------------------
+
 def create_layer(row, prev_depth, only_raw_data, no_units=False):
 
     layer = {"type": "SoilParameters"}
@@ -144,50 +353,50 @@ def create_layer(row, prev_depth, only_raw_data, no_units=False):
 
 #------------------------------------------------------------------------------
 
-def get_soil_profile(con, profile_id=None, only_raw_data=True, no_units=False):
-    "return soil parameters from the database connection for given profile id"
-    query = """
-        select 
-            id, 
-            layer_depth, 
-            soil_organic_carbon, 
-            soil_organic_matter, 
-            bulk_density, 
-            raw_density,
-            sand, 
-            clay,
-            silt, 
-            ph, 
-            KA5_texture_class,
-            permanent_wilting_point,
-            field_capacity,
-            saturation,
-            soil_water_conductivity_coefficient,
-            sceleton,
-            soil_ammonium,
-            soil_nitrate,
-            c_n,
-            initial_soil_moisture,
-            layer_description,
-            is_in_groundwater,
-            is_impenetrable
-        from soil_profile 
-        {} 
-        order by id, layer_depth
-    """.format(" where id = ? " if profile_id else " ")
-    
-    con.row_factory = sqlite3.Row
-    rows = con.cursor().execute(query, (profile_id,)) if profile_id else con.cursor().execute(query)
+SOIL_PROFILE_QUERY = """
+    select 
+        id, 
+        layer_depth, 
+        soil_organic_carbon, 
+        soil_organic_matter, 
+        bulk_density, 
+        raw_density,
+        sand, 
+        clay,
+        silt, 
+        ph, 
+        KA5_texture_class,
+        permanent_wilting_point,
+        field_capacity,
+        saturation,
+        soil_water_conductivity_coefficient,
+        sceleton,
+        soil_ammonium,
+        soil_nitrate,
+        c_n,
+        initial_soil_moisture,
+        layer_description,
+        is_in_groundwater,
+        is_impenetrable
+    from soil_profile 
+    {} 
+    order by id, layer_depth
+"""
+
+
+def gen_profiles_from_rows(rows, only_raw_data, no_units, profile_ids=None):
+    "group the rows (ordered by id, layer_depth) into (id, layers), only the ids in profile_ids if given"
     last_profile_id = None
-    profiles = []
     layers = []
     prev_depth = 0
     for row in rows:
         id = int(row["id"])
-        if not last_profile_id:
+        if profile_ids is not None and id not in profile_ids:
+            continue
+        if last_profile_id is None:
             last_profile_id = id
         if last_profile_id != id:
-            profiles.append((last_profile_id, layers))
+            yield (last_profile_id, layers)
             last_profile_id = id
             layers = []
             prev_depth = 0
@@ -195,53 +404,382 @@ def get_soil_profile(con, profile_id=None, only_raw_data=True, no_units=False):
         layer, prev_depth = create_layer(row, prev_depth, only_raw_data, no_units=no_units)
         layers.append(layer)
 
-    # store also last profile
-    profiles.append((last_profile_id, layers))
+    if last_profile_id is not None:
+        yield (last_profile_id, layers)
+
+
+def get_soil_profile(con, profile_id=None, only_raw_data=True, no_units=False):
+    "return soil parameters from the database connection for given profile id"
+    query = SOIL_PROFILE_QUERY.format(" where id = ? " if profile_id else " ")
+    
+    cursor = con.cursor()
+    cursor.row_factory = sqlite3.Row
+    rows = cursor.execute(query, (profile_id,)) if profile_id else cursor.execute(query)
+    profiles = list(gen_profiles_from_rows(rows, only_raw_data, no_units))
+
+    # no profile found
+    if len(profiles) == 0:
+        profiles.append((None, []))
 
     return profiles
 
 #------------------------------------------------------------------------------
 
-def get_soil_profile_group(con, profile_group_id=None, only_raw_data=True, no_units=False):
-    "return soil profile groups from the database connection for given profile group id"
-    query = """
-        select 
-            polygon_id,
-            profile_id_in_polygon,
-            range_percentage_of_area,
-            avg_range_percentage_of_area,
-            layer_depth, 
-            soil_organic_carbon, 
-            soil_organic_matter, 
-            bulk_density, 
-            raw_density,
-            sand, 
-            clay, 
-            silt,
-            ph, 
-            KA5_texture_class,
-            permanent_wilting_point,
-            field_capacity,
-            saturation,
-            soil_water_conductivity_coefficient,
-            sceleton,
-            soil_ammonium,
-            soil_nitrate,
-            c_n,
-            initial_soil_moisture,
-            layer_description,
-            is_in_groundwater,
-            is_impenetrable
-        from soil_profile_all
-        {} 
-        order by polygon_id, profile_id_in_polygon, layer_depth
-    """.format(" where polygon_id = ? " if profile_group_id else " ")
-    
-    con.row_factory = sqlite3.Row
-    rows = con.cursor().execute(query, (profile_group_id,)) if profile_group_id else con.cursor().execute(query)
+def read_soil_profile_columns(con, profile_id=None):
+    """read the soil_profile table (ordered by id, layer_depth) into columns
+    id as int64, the text columns as object arrays (None = null), all other columns as float64 (NaN = null)"""
+
+    query = SOIL_PROFILE_QUERY.format(" where id = ? " if profile_id else " ")
+    cursor = con.cursor()
+    cursor.row_factory = None
+    rows = (cursor.execute(query, (profile_id,)) if profile_id else cursor.execute(query)).fetchall()
+
+    columns = {}
+    for col, values in zip(soil_profile_columns(), zip(*rows) if rows else [[]] * len(soil_profile_columns())):
+        if col == "id":
+            columns[col] = np.array([int(v) for v in values], dtype=np.int64)
+        elif col in SOIL_PROFILE_TEXT_COLUMNS:
+            columns[col] = np.array(values, dtype=object)
+        else:
+            columns[col] = np.array([np.nan if v is None else float(v) for v in values], dtype=np.float64)
+    return columns
+
+
+def sand_and_clay_to_ka5_texture_columns(sand, clay):
+    "vectorized sand_and_clay_to_ka5_texture"
+    silt = 1.0 - sand - clay
+    conditions_and_classes = [
+        ((silt < 0.1) & (clay < 0.05), "Ss"),
+        ((silt < 0.25) & (clay < 0.05), "Su2"),
+        ((silt < 0.25) & (clay < 0.08), "Sl2"),
+        ((silt < 0.40) & (clay < 0.08), "Su3"),
+        ((silt < 0.50) & (clay < 0.08), "Su4"),
+        ((silt < 0.8) & (clay < 0.08), "Us"),
+        ((silt >= 0.8) & (clay < 0.08), "Uu"),
+        ((silt < 0.1) & (clay < 0.17), "St2"),
+        ((silt < 0.4) & (clay < 0.12), "Sl3"),
+        ((silt < 0.4) & (clay < 0.17), "Sl4"),
+        ((silt < 0.5) & (clay < 0.17), "Slu"),
+        ((silt < 0.65) & (clay < 0.17), "Uls"),
+        ((silt >= 0.65) & (clay < 0.12), "Ut2"),
+        ((silt >= 0.65) & (clay < 0.17), "Ut3"),
+        ((silt < 0.15) & (clay < 0.25), "St3"),
+        ((silt < 0.30) & (clay < 0.25), "Ls4"),
+        ((silt < 0.40) & (clay < 0.25), "Ls3"),
+        ((silt < 0.50) & (clay < 0.25), "Ls2"),
+        ((silt < 0.65) & (clay < 0.30), "Lu"),
+        ((silt >= 0.65) & (clay < 0.25), "Ut4"),
+        ((silt < 0.15) & (clay < 0.35), "Ts4"),
+        ((silt < 0.30) & (clay < 0.45), "Lts"),
+        ((silt < 0.50) & (clay < 0.35), "Lt2"),
+        ((silt < 0.65) & (clay < 0.45), "Tu3"),
+        ((silt >= 0.65) & (clay >= 0.25), "Tu4"),
+        ((silt < 0.15) & (clay < 0.45), "Ts3"),
+        ((silt < 0.50) & (clay < 0.45), "Lt3"),
+        ((silt < 0.15) & (clay < 0.65), "Ts2"),
+        ((silt < 0.30) & (clay < 0.65), "Tl"),
+        ((silt >= 0.30) & (clay < 0.65), "Tu2"),
+        ((clay >= 0.65), "Tt")
+    ]
+    return np.select([c for c, _ in conditions_and_classes], [t for _, t in conditions_and_classes], default="").astype(object)
+
+
+def ka5_texture_to_sand_clay_silt_columns(ka5_textures):
+    "vectorized ka5_texture_to_sand_clay_silt, returns the sand, clay and silt columns"
+    textures, idxs = np.unique(np.asarray(ka5_textures, dtype=str), return_inverse=True)
+    values = [ka5_texture_to_sand_clay_silt(texture) for texture in textures.tolist()]
+    return tuple(np.array([v[key] for v in values], dtype=np.float64)[idxs].reshape(np.shape(ka5_textures))
+                 for key in ["sand", "clay", "silt"])
+
+
+def create_layers_from_columns(columns, only_raw_data=True, no_units=False):
+    """vectorized create_layer for all rows of soil profile columns (see read_soil_profile_columns),
+    returns the list of layer dicts, one per row, equal to the ones of create_layer"""
+
+    n = len(columns["id"])
+    has = {col: ~np.isnan(arr) if arr.dtype.kind == "f" else np.array([v is not None for v in arr], dtype=bool)
+           for col, arr in columns.items()}
+
+    # layer thickness: depth minus the last known depth of the same profile (0 at the start of a profile)
+    depth = columns["layer_depth"]
+    row_idxs = np.arange(n)
+    is_start = np.ones(n, dtype=bool)
+    is_start[1:] = columns["id"][1:] != columns["id"][:-1]
+    profile_start = np.maximum.accumulate(np.where(is_start, row_idxs, 0)) if n else row_idxs
+    last_known = np.maximum.accumulate(np.where(has["layer_depth"], row_idxs, -1)) if n else row_idxs
+    prev_known = np.concatenate(([-1], last_known[:-1]))
+    prev_depth = np.where(prev_known >= profile_start, depth[np.maximum(prev_known, 0)], 0.0) if n else depth
+    thickness = depth - prev_depth
+
+    derive = not only_raw_data
+    ka5 = columns["KA5_texture_class"]
+    sand = columns["sand"] / 100.0
+    clay = columns["clay"] / 100.0
+    silt = columns["silt"] / 100.0
+
+    ka5_sand_clay = has["sand"] & has["clay"] & ~has["KA5_texture_class"] & derive
+    ka5_out = np.where(ka5_sand_clay, sand_and_clay_to_ka5_texture_columns(sand, clay), ka5)
+    has_ka5_out = has["KA5_texture_class"] | ka5_sand_clay
+
+    # sand/silt derived from the KA5 class are (as in create_layer) the silt and clay of the class
+    derive_from_ka5 = has["KA5_texture_class"] & derive
+    ka5_sand, ka5_clay, ka5_silt = ka5_texture_to_sand_clay_silt_columns(np.where(derive_from_ka5, ka5, ""))
+    sand_out, has_sand_out = np.where(has["sand"], sand, ka5_silt), has["sand"] | derive_from_ka5
+    clay_out, has_clay_out = np.where(has["clay"], clay, ka5_clay), has["clay"] | derive_from_ka5
+    silt_out, has_silt_out = np.where(has["silt"], silt, ka5_clay), has["silt"] | derive_from_ka5
+
+    soc = columns["soil_organic_carbon"]
+    som = columns["soil_organic_matter"]
+    soc_out = np.where(has["soil_organic_carbon"], soc, organic_matter_to_organic_carbon(som))
+    has_soc_out = has["soil_organic_carbon"] | (has["soil_organic_matter"] & derive)
+    som_out = np.where(has["soil_organic_matter"], som / 100.0, organic_carbon_to_organic_matter(soc / 100.0))
+    has_som_out = has["soil_organic_matter"] | (has["soil_organic_carbon"] & derive)
+
+    bulk = columns["bulk_density"]
+    raw = columns["raw_density"]
+    bulk_out = np.where(has["bulk_density"], bulk, raw_density_to_bulk_density(raw, clay_out))
+    has_bulk_out = has["bulk_density"] | (has["raw_density"] & has_clay_out & derive)
+    raw_out = np.where(has["raw_density"], raw, bulk_density_to_raw_density(bulk, clay_out))
+    has_raw_out = has["raw_density"] | (has["bulk_density"] & has_clay_out & derive)
+
+    def flag(col):
+        return np.trunc(np.nan_to_num(columns[col])) == 1
+
+    # (layer key, values, which rows have a value, unit or None)
+    outputs = [
+        ("Thickness", thickness, has["layer_depth"], "m"),
+        ("KA5TextureClass", ka5_out, has_ka5_out, None),
+        ("Sand", sand_out, has_sand_out, "% [0-1]"),
+        ("Clay", clay_out, has_clay_out, "% [0-1]"),
+        ("Silt", silt_out, has_silt_out, "% [0-1]"),
+        ("pH", columns["ph"], has["ph"], None),
+        ("Sceleton", columns["sceleton"] / 100.0, has["sceleton"], "vol% [0-1]"),
+        ("SoilOrganicCarbon", soc_out, has_soc_out, "mass% [0-100]"),
+        ("SoilOrganicMatter", som_out, has_som_out, "mass% [0-1]"),
+        ("SoilBulkDensity", bulk_out, has_bulk_out, "kg m-3"),
+        ("SoilRawDensity", raw_out, has_raw_out, "kg m-3"),
+        ("FieldCapacity", columns["field_capacity"] / 100.0, has["field_capacity"], "vol% [0-1]"),
+        ("PermanentWiltingPoint", columns["permanent_wilting_point"] / 100.0, has["permanent_wilting_point"], "vol% [0-1]"),
+        ("PoreVolume", columns["saturation"] / 100.0, has["saturation"], "vol% [0-1]"),
+        ("SoilMoisturePercentFC", columns["initial_soil_moisture"], has["initial_soil_moisture"], "% [0-100]"),
+        ("Lambda", columns["soil_water_conductivity_coefficient"], has["soil_water_conductivity_coefficient"], None),
+        ("SoilAmmonium", columns["soil_ammonium"], has["soil_ammonium"], "kg NH4-N m-3"),
+        ("SoilNitrate", columns["soil_nitrate"], has["soil_nitrate"], "kg NO3-N m-3"),
+        ("CN", columns["c_n"], has["c_n"], None),
+        ("description", columns["layer_description"], has["layer_description"], None),
+        ("is_in_groundwater", flag("is_in_groundwater"), has["is_in_groundwater"], None),
+        ("is_impenetrable", flag("is_impenetrable"), has["is_impenetrable"], None)
+    ]
+
+    layers = [{"type": "SoilParameters"} for _ in range(n)]
+    for key, values, is_set, unit in outputs:
+        values = values.tolist()
+        for i in np.nonzero(is_set)[0].tolist():
+            layers[i][key] = values[i] if unit is None or no_units else [values[i], unit]
+    return layers
+
+
+def get_soil_profile_columnar(con, profile_id=None, only_raw_data=True, no_units=False):
+    "return soil parameters like get_soil_profile, but derived column wise for all layers at once"
+
+    columns = read_soil_profile_columns(con, profile_id)
+    layers = create_layers_from_columns(columns, only_raw_data=only_raw_data, no_units=no_units)
+
+    profiles = []
+    ids = columns["id"].tolist()
+    for i, (id, layer) in enumerate(zip(ids, layers)):
+        if i == 0 or id != ids[i - 1]:
+            profiles.append((id, []))
+        profiles[-1][1].append(layer)
+
+    if len(profiles) == 0:
+        profiles.append((None, []))
+    return profiles
+
+#------------------------------------------------------------------------------
+
+SOIL_PROFILE_STORE_MAGIC = b"SOILSOA1"
+SOIL_PROFILE_STORE_ALIGNMENT = 64
+SOIL_PROFILE_TEXT_COLUMNS = ["KA5_texture_class", "layer_description"]
+
+
+def soil_profile_columns():
+    "the columns of soil_profile in the order of SOIL_PROFILE_QUERY"
+    select = SOIL_PROFILE_QUERY.split("select")[1].split("from")[0]
+    return [col.strip() for col in select.split(",")]
+
+
+def compile_soil_profile_store(con, path_to_store_file):
+    """compile the soil_profile table into a single binary file, which can be memory mapped by open_soil_profile_store
+    layout: magic, header length (uint64), json header, then one array per column (structure of arrays, rows ordered
+    by id and layer_depth), the numeric columns as float64 (NaN = null), the text columns as int32 codes into
+    string tables in the header (-1 = null), plus the sorted profile ids and the offsets of their first rows"""
+
+    columns = soil_profile_columns()
+    cursor = con.cursor()
+    cursor.row_factory = None
+    rows = cursor.execute(SOIL_PROFILE_QUERY.format(" ")).fetchall()
+
+    arrays = {}
+    strings = {}
+    for i, col in enumerate(columns):
+        if col == "id":
+            arrays[col] = np.array([int(row[i]) for row in rows], dtype=np.int64)
+        elif col in SOIL_PROFILE_TEXT_COLUMNS:
+            table = {}
+            arrays[col] = np.array([-1 if row[i] is None else table.setdefault(row[i], len(table)) for row in rows], dtype=np.int32)
+            strings[col] = list(table.keys())
+        else:
+            arrays[col] = np.array([np.nan if row[i] is None else float(row[i]) for row in rows], dtype=np.float64)
+
+    ids, offsets = np.unique(arrays["id"], return_index=True)
+    arrays["profile_ids"] = ids
+    arrays["profile_offsets"] = np.append(offsets, len(rows)).astype(np.int64)
+
+    header = {"rows": len(rows), "strings": strings, "columns": {}}
+    offset = 0
+    for col, arr in arrays.items():
+        header["columns"][col] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+        offset += -(-arr.nbytes // SOIL_PROFILE_STORE_ALIGNMENT) * SOIL_PROFILE_STORE_ALIGNMENT
+    header_bytes = json.dumps(header).encode()
+    data_start = -(-(len(SOIL_PROFILE_STORE_MAGIC) + 8 + len(header_bytes)) // SOIL_PROFILE_STORE_ALIGNMENT) * SOIL_PROFILE_STORE_ALIGNMENT
+
+    tmp_path = path_to_store_file + ".tmp{}".format(os.getpid())
+    with open(tmp_path, "wb") as _:
+        _.write(SOIL_PROFILE_STORE_MAGIC)
+        _.write(np.uint64(len(header_bytes)).tobytes())
+        _.write(header_bytes)
+        for col, arr in arrays.items():
+            _.seek(data_start + header["columns"][col]["offset"])
+            _.write(arr.tobytes())
+        _.truncate(data_start + offset)
+    os.replace(tmp_path, path_to_store_file)
+
+
+def open_soil_profile_store(path_to_store_file):
+    "open a compiled soil profile store, the column arrays are memory mapped (read only, shared between processes)"
+
+    with open(path_to_store_file, "rb") as _:
+        if _.read(len(SOIL_PROFILE_STORE_MAGIC)) != SOIL_PROFILE_STORE_MAGIC:
+            raise ValueError("Not a soil profile store: {}".format(path_to_store_file))
+        header_length = int(np.frombuffer(_.read(8), dtype=np.uint64)[0])
+        header = json.loads(_.read(header_length).decode())
+    data_start = -(-(len(SOIL_PROFILE_STORE_MAGIC) + 8 + header_length) // SOIL_PROFILE_STORE_ALIGNMENT) * SOIL_PROFILE_STORE_ALIGNMENT
+
+    store = {"path": path_to_store_file, "strings": header["strings"], "columns": {}}
+    for col, desc in header["columns"].items():
+        if desc["shape"][0] == 0:
+            store["columns"][col] = np.empty(desc["shape"], dtype=desc["dtype"])
+        else:
+            store["columns"][col] = np.memmap(path_to_store_file, dtype=desc["dtype"], mode="r",
+                                              offset=data_start + desc["offset"], shape=tuple(desc["shape"]))
+    return store
+
+
+def load_or_compile_soil_profile_store(path_to_soil_db, path_to_store_file=None):
+    "open the compiled store of a soil db (default <db>.soa), it is (re)compiled if missing or older than the db"
+
+    if path_to_store_file is None:
+        path_to_store_file = path_to_soil_db + ".soa"
+
+    if not os.path.exists(path_to_store_file) or os.path.getmtime(path_to_store_file) < os.path.getmtime(path_to_soil_db):
+        con = sqlite3.connect(path_to_soil_db)
+        try:
+            compile_soil_profile_store(con, path_to_store_file)
+        finally:
+            con.close()
+
+    return open_soil_profile_store(path_to_store_file)
+
+
+def gen_rows_from_store(store, start, end):
+    "yield the rows start to end of the store as dicts like the sqlite rows of SOIL_PROFILE_QUERY"
+    cols = store["columns"]
+    values = {}
+    for col in soil_profile_columns():
+        if col in SOIL_PROFILE_TEXT_COLUMNS:
+            strings = store["strings"][col]
+            values[col] = [None if code < 0 else strings[code] for code in cols[col][start:end].tolist()]
+        elif col == "id":
+            values[col] = cols[col][start:end].tolist()
+        else:
+            values[col] = [None if v != v else v for v in cols[col][start:end].tolist()]
+    for i in range(end - start):
+        yield {col: vs[i] for col, vs in values.items()}
+
+
+def get_soil_profile_from_store(store, profile_id=None, only_raw_data=True, no_units=False):
+    "return soil parameters from a compiled soil profile store for given profile id, same as get_soil_profile"
+
+    offsets = store["columns"]["profile_offsets"]
+    if profile_id:
+        ids = store["columns"]["profile_ids"]
+        i = int(np.searchsorted(ids, int(profile_id)))
+        if i == len(ids) or ids[i] != int(profile_id):
+            return [(None, [])]
+        start, end = int(offsets[i]), int(offsets[i + 1])
+    else:
+        start, end = 0, int(offsets[-1])
+
+    profiles = list(gen_profiles_from_rows(gen_rows_from_store(store, start, end), only_raw_data, no_units))
+    if len(profiles) == 0:
+        profiles.append((None, []))
+    return profiles
+
+
+def soil_parameters_from_store(store, profile_id):
+    "soil_parameters from a compiled soil profile store"
+    return check_layers(get_soil_profile_from_store(store, profile_id)[0][1])
+
+#------------------------------------------------------------------------------
+
+SOIL_PROFILE_GROUP_QUERY = """
+    select 
+        polygon_id,
+        profile_id_in_polygon,
+        range_percentage_of_area,
+        avg_range_percentage_of_area,
+        layer_depth, 
+        soil_organic_carbon, 
+        soil_organic_matter, 
+        bulk_density, 
+        raw_density,
+        sand, 
+        clay, 
+        silt,
+        ph, 
+        KA5_texture_class,
+        permanent_wilting_point,
+        field_capacity,
+        saturation,
+        soil_water_conductivity_coefficient,
+        sceleton,
+        soil_ammonium,
+        soil_nitrate,
+        c_n,
+        initial_soil_moisture,
+        layer_description,
+        is_in_groundwater,
+        is_impenetrable
+    from soil_profile_all
+    {} 
+    order by polygon_id, profile_id_in_polygon, layer_depth
+"""
+
+
+def fetch_rows(cursor, fetch_size):
+    "yield the rows of an executed cursor, fetching fetch_size rows at a time"
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if not rows:
+            break
+        yield from rows
+
+
+def gen_profile_groups_from_rows(rows, only_raw_data, no_units):
+    "group the rows (ordered by polygon_id, profile_id_in_polygon, layer_depth) into (polygon_id, profiles)"
     last_profile_group_id = None
     last_profile_id = None
-    profile_groups = []
     profiles = []
     layers = []
     prev_depth = 0
@@ -269,7 +807,7 @@ def get_soil_profile_group(con, profile_group_id=None, only_raw_data=True, no_un
             prev_depth = 0
 
         if group_id != last_profile_group_id:
-            profile_groups.append((last_profile_group_id, profiles))
+            yield (last_profile_group_id, profiles)
             last_profile_group_id = group_id
             profiles = []
 
@@ -277,27 +815,71 @@ def get_soil_profile_group(con, profile_group_id=None, only_raw_data=True, no_un
         layers.append(layer)
 
     # store also last profile and profile group 
-    profiles.append({
-        "id": last_profile_id,
-        "layers": layers,
-        "range_percentage_in_group": range_percentage,
-        "avg_range_percentage_in_group": avg_percentage
-    })
-    profile_groups.append((last_profile_group_id, profiles))
+    if last_profile_group_id is not None:
+        profiles.append({
+            "id": last_profile_id,
+            "layers": layers,
+            "range_percentage_in_group": range_percentage,
+            "avg_range_percentage_in_group": avg_percentage
+        })
+        yield (last_profile_group_id, profiles)
+
+
+def get_soil_profile_group(con, profile_group_id=None, only_raw_data=True, no_units=False):
+    "return soil profile groups from the database connection for given profile group id"
+    query = SOIL_PROFILE_GROUP_QUERY.format(" where polygon_id = ? " if profile_group_id else " ")
+    
+    cursor = con.cursor()
+    cursor.row_factory = sqlite3.Row
+    rows = cursor.execute(query, (profile_group_id,)) if profile_group_id else cursor.execute(query)
+    profile_groups = list(gen_profile_groups_from_rows(rows, only_raw_data, no_units))
+
+    # no profile group found
+    if len(profile_groups) == 0:
+        profile_groups.append((None, [{
+            "id": None,
+            "layers": [],
+            "range_percentage_in_group": "",
+            "avg_range_percentage_in_group": 0
+        }]))
 
     return profile_groups
 
 #------------------------------------------------------------------------------
 
+def iter_soil_profile(con, profile_id=None, only_raw_data=True, no_units=False, fetch_size=1000):
+    """generator version of get_soil_profile, yields (id, layers) while the ordered cursor advances,
+    so all profiles can be processed in constant memory"""
+    query = SOIL_PROFILE_QUERY.format(" where id = ? " if profile_id else " ")
+
+    cursor = con.cursor()
+    cursor.row_factory = sqlite3.Row
+    cursor = cursor.execute(query, (profile_id,)) if profile_id else cursor.execute(query)
+    yield from gen_profiles_from_rows(fetch_rows(cursor, fetch_size), only_raw_data, no_units)
+
+
+def iter_soil_profile_group(con, profile_group_id=None, only_raw_data=True, no_units=False, fetch_size=1000):
+    """generator version of get_soil_profile_group, yields (polygon_id, profiles) while the ordered cursor advances,
+    so all soil polygons can be processed in constant memory"""
+    query = SOIL_PROFILE_GROUP_QUERY.format(" where polygon_id = ? " if profile_group_id else " ")
+
+    cursor = con.cursor()
+    cursor.row_factory = sqlite3.Row
+    cursor = cursor.execute(query, (profile_group_id,)) if profile_group_id else cursor.execute(query)
+    yield from gen_profile_groups_from_rows(fetch_rows(cursor, fetch_size), only_raw_data, no_units)
+
+#------------------------------------------------------------------------------
+
 def available_soil_parameters_group(con, table="soil_profile_all", id_col="polygon_id", only_raw_data=True):
     return available_soil_parameters(con, table=table, id_col=id_col, only_raw_data=only_raw_data)
 
 #------------------------------------------------------------------------------
 
 def available_soil_parameters(con, table="soil_profile", id_col="id", only_raw_data=True):
-    "return which soil parameters in the database are always there (mandatory) and which are sometimes there (optional) "
+    """return which soil parameters in the database are always there (mandatory) and which are sometimes there (optional)
+    and per parameter the share of the rows which have a value (coverage, 1.0 for an empty table),
+    all null counts are computed in a single scan of the table"""
 
-    query = "select count({}) as count from {} where {} is null"
     params = {
         "layer_depth": "Thickness",
         "soil_organic_carbon": "SoilOrganicCarbon", 
@@ -325,15 +907,23 @@ def available_soil_parameters(con, table="soil_profile", id_col="id", only_raw_d
 
     mandatory = []
     optional = []
-
+    coverage = {}
+
+    query = "select count({id_col}) as total, {null_counts} from {table}".format(
+        id_col=id_col,
+        table=table,
+        null_counts=", ".join("count(case when {0} is null then {1} end) as {0}".format(param, id_col) for param in params.keys()))
+    cursor = con.cursor()
+    cursor.row_factory = sqlite3.Row
+    row = cursor.execute(query).fetchone()
+    total = int(row["total"])
     for param in params.keys():
-        con.row_factory = sqlite3.Row
-        q = query.format(id_col, table, param)
-        for row in con.cursor().execute(q):
-            if int(row["count"]) == 0:
-                mandatory.append(params[param])
-            else:
-                optional.append(params[param])
+        null_count = int(row[param])
+        if null_count == 0:
+            mandatory.append(params[param])
+        else:
+            optional.append(params[param])
+        coverage[params[param]] = 1.0 - null_count / total if total > 0 else 1.0
 
     # update mandatory list if we can derive some data
     if not only_raw_data:
@@ -352,7 +942,7 @@ def available_soil_parameters(con, table="soil_profile", id_col="id", only_raw_d
         move_from_optional("SoilRawDensity", if_="SoilBulkDensity" in mandatory and "Clay" in mandatory)
         move_from_optional("SoilBulkDensity", if_="SoilRawDensity" in mandatory and "Clay" in mandatory)
 
-    return {"mandatory": mandatory, "optional": optional}
+    return {"mandatory": mandatory, "optional": optional, "coverage": coverage}
 
 #------------------------------------------------------------------------------
 